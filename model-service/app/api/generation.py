@@ -1,10 +1,12 @@
 """Generation API endpoints."""
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
+import asyncio
+import json
 import logging
-import multiprocessing
 import os
 
 from ..models.ace_step import ACEStepModel, CancelledError
@@ -15,7 +17,8 @@ from ..core import (
     get_current_provider, 
     get_provider_status
 )
-from ..services.generation_job import job_manager, JobStatus
+from ..services.generation_job import job_manager, JobOutcome, JobStatus, ProgressRing, ThrottledProgress
+from ..services.mistral_worker import mistral_worker
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +31,7 @@ class GenerationRequest(BaseModel):
     duration: float = Field(..., gt=0, le=300, description="Target duration in seconds (max 300)")
     lyrics: Optional[str] = Field(None, description="Optional lyrics for the music (default: '[inst]' for instrumental)")
     num_versions: int = Field(1, ge=1, le=5, description="Number of versions to generate (1-5)")
-    format: str = Field("wav", description="Output format ('wav' or 'mp3')")
+    format: Literal["wav", "mp3", "ogg", "flac"] = Field("wav", description="Output format ('wav', 'mp3', 'ogg' or 'flac')")
     manual_seeds: Optional[int] = Field(None, description="Optional seed for reproducibility")
     job_id: Optional[str] = Field(None, description="Optional job ID (generated if not provided)")
     provider: Optional[str] = Field(None, description="Optional provider override ('ace-step' or 'song-generation'). Uses default from MUSIC_PROVIDER env var if not specified.")
@@ -71,6 +74,21 @@ class JobStatusResponse(BaseModel):
     error: Optional[str] = None
 
 
+def warm_generation_worker():
+    """
+    Load the default music model when a generation worker process starts.
+    
+    Runs as the worker pool's initializer, so the model is loaded in the process
+    that will use it. Must not raise: a failing initializer breaks the pool.
+    """
+    try:
+        model = get_model()
+        if hasattr(model, "warm"):
+            model.warm()
+    except Exception as e:
+        logger.warning(f"Generation worker warm-up failed: {e}")
+
+
 def _run_generation(
     job_id: str,
     prompt: str,
@@ -79,31 +97,36 @@ def _run_generation(
     num_versions: int,
     format: str,
     manual_seeds: Optional[int],
-    cancellation_event: multiprocessing.Event,
-    progress_queue: multiprocessing.Queue,
-    shared_state: Dict[str, Any],
+    progress_ring: ProgressRing,
+    provider: Optional[str] = None,
     **kwargs
-):
+) -> JobOutcome:
     """
-    Run generation in background process.
+    Run generation on a generation worker process.
     
     This function runs in a separate process and cannot access the job object directly.
-    It communicates via shared state and progress queue.
+    Progress goes through the ring buffer; the final status update (with results or
+    error) is the returned JobOutcome, which the API process applies to the job.
     """
-    # Get provider from shared state (set by the API endpoint)
-    provider = shared_state.get("provider", None)
+    # Lets the API process stop this worker if the job is cancelled but doesn't stop
+    progress_ring.set_worker_pid(os.getpid())
+    cancellation_event = progress_ring.cancellation_flag
     
     # Initialize model in worker process (models can't be shared across processes)
     model = get_model(provider=provider)
     
+    last_progress = 0.0
+    report_progress = ThrottledProgress(progress_ring)
+    
     try:
         # Update status to processing
-        shared_state["status"] = JobStatus.PROCESSING.value
-        progress_queue.put({"status": JobStatus.PROCESSING.value, "progress": 0.0, "step": "Starting generation"})
+        report_progress(0.0, "Starting generation", JobStatus.PROCESSING)
         
-        # Progress callback that sends updates via queue
+        # Progress callback that sends (rate-limited) updates via the ring buffer
         def progress_callback(progress: float, step: str):
-            progress_queue.put({"progress": progress, "step": step})
+            nonlocal last_progress
+            last_progress = progress
+            report_progress(progress, step)
         
         # Run generation with progress and cancellation support
         results = model.generate(
@@ -128,27 +151,16 @@ def _run_generation(
             for r in results
         ]
         
-        # Update shared state with results
-        shared_state["status"] = JobStatus.COMPLETED.value
-        shared_state["results"] = results_list
-        shared_state["progress"] = 100.0
-        shared_state["current_step"] = "Completed"
-        progress_queue.put({"status": JobStatus.COMPLETED.value, "progress": 100.0, "step": "Completed", "results": results_list})
-        
         logger.info(f"Job {job_id} completed successfully")
+        return JobOutcome(JobStatus.COMPLETED, progress=100.0, step="Completed", results=results_list)
         
     except (CancelledError, SongGenerationCancelledError):
-        shared_state["status"] = JobStatus.CANCELLED.value
-        current_progress = shared_state.get("progress", 0.0)
-        shared_state["current_step"] = "Cancelled"
-        progress_queue.put({"status": JobStatus.CANCELLED.value, "progress": current_progress, "step": "Cancelled"})
         logger.info(f"Job {job_id} was cancelled")
+        return JobOutcome(JobStatus.CANCELLED, progress=last_progress, step="Cancelled")
         
     except Exception as e:
         logger.error(f"Job {job_id} failed: {e}", exc_info=True)
-        shared_state["status"] = JobStatus.FAILED.value
-        shared_state["error"] = str(e)
-        progress_queue.put({"status": JobStatus.FAILED.value, "error": str(e)})
+        return JobOutcome(JobStatus.FAILED, error=str(e))
 
 
 @router.post("/generate", response_model=GenerationJobResponse)
@@ -196,34 +208,26 @@ async def generate_music(request: GenerationRequest):
         
         job = job_manager.get_job(job_id)
         
-        # Store provider in shared state for the background process
-        job.shared_state["provider"] = provider
-        
         logger.info(
             f"Starting background generation job {job_id} with {request.num_versions} version(s) "
             f"using provider '{provider or 'default'}' and prompt: {request.prompt[:50]}..."
         )
         
-        # Start generation in background process
-        process = multiprocessing.Process(
-            target=_run_generation,
-            args=(
-                job.job_id,
-                job.prompt,
-                job.duration,
-                job.lyrics,
-                job.num_versions,
-                job.format,
-                job.manual_seeds,
-                job.cancellation_event,
-                job.progress_queue,
-                job.shared_state,
-            ),
-            kwargs=job.kwargs,
-            daemon=False  # Don't use daemon to allow proper cleanup
+        # Start generation on the background worker pool
+        job_manager.submit_job(
+            job,
+            _run_generation,
+            job.job_id,
+            job.prompt,
+            job.duration,
+            job.lyrics,
+            job.num_versions,
+            job.format,
+            job.manual_seeds,
+            job.progress_ring,
+            provider,
+            **job.kwargs
         )
-        process.start()
-        job.process = process
         
         return GenerationJobResponse(
             job_id=job_id,
@@ -247,11 +251,18 @@ async def generate_music(request: GenerationRequest):
         )
 
 
+def _job_etag(snapshot: Dict[str, Any]) -> str:
+    """ETag for a job snapshot, derived from the job's version counter."""
+    return f'"{snapshot["job_id"]}-{snapshot["version"]}"'
+
+
 @router.get("/generate/{job_id}/progress", response_model=ProgressResponse)
-async def get_generation_progress(job_id: str):
+async def get_generation_progress(job_id: str, request: Request, response: Response):
     """
     Get the progress of a generation job.
     
+    Supports If-None-Match: returns 304 when the job hasn't changed since the given ETag.
+    
     Args:
         job_id: Job ID
         
@@ -266,14 +277,71 @@ async def get_generation_progress(job_id: str):
             detail=f"Job {job_id} not found"
         )
     
-    # Poll progress queue to get latest updates
-    job._poll_progress_queue()
+    snapshot = job.to_dict()
+    etag = _job_etag(snapshot)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     
     return ProgressResponse(
         job_id=job_id,
-        progress=job.progress,
-        current_step=job.current_step,
-        status=job.status.value
+        progress=snapshot["progress"],
+        current_step=snapshot["current_step"],
+        status=snapshot["status"]
+    )
+
+
+# Seconds between progress polls of an events stream
+EVENTS_POLL_INTERVAL_SECONDS = 0.5
+# Seconds of silence after which an events stream sends a keep-alive comment
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+@router.get("/generate/{job_id}/events")
+async def stream_generation_events(job_id: str):
+    """
+    Stream job updates as Server-Sent Events.
+    
+    Sends the current job snapshot, then one event per change, and ends once the
+    job reaches a terminal status.
+    
+    Args:
+        job_id: Job ID
+        
+    Returns:
+        text/event-stream response of job snapshots (same fields as the job's to_dict())
+    """
+    job = job_manager.get_job(job_id)
+    
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job {job_id} not found"
+        )
+    
+    async def events():
+        last_version = None
+        idle_seconds = 0.0
+        while True:
+            # to_dict() refreshes the job first, so worker progress shows up here
+            snapshot = job.to_dict()
+            if snapshot["version"] != last_version:
+                last_version = snapshot["version"]
+                idle_seconds = 0.0
+                yield f"event: status\ndata: {json.dumps(snapshot, default=str)}\n\n"
+                if snapshot["status"] in (JobStatus.COMPLETED.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value):
+                    break
+            elif idle_seconds >= EVENTS_KEEPALIVE_SECONDS:
+                idle_seconds = 0.0
+                yield ": keep-alive\n\n"
+            
+            await asyncio.sleep(EVENTS_POLL_INTERVAL_SECONDS)
+            idle_seconds += EVENTS_POLL_INTERVAL_SECONDS
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
     )
 
 
@@ -354,10 +422,12 @@ async def delete_job(job_id: str):
 
 
 @router.get("/generate/{job_id}/status", response_model=JobStatusResponse)
-async def get_generation_status(job_id: str):
+async def get_generation_status(job_id: str, request: Request, response: Response):
     """
     Get the status and results of a generation job.
     
+    Supports If-None-Match: returns 304 when the job hasn't changed since the given ETag.
+    
     Args:
         job_id: Job ID
         
@@ -372,27 +442,30 @@ async def get_generation_status(job_id: str):
             detail=f"Job {job_id} not found"
         )
     
-    # Poll progress queue to get latest updates
-    job._poll_progress_queue()
+    snapshot = job.to_dict()
+    etag = _job_etag(snapshot)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     
     versions = None
-    if job.results:
+    if snapshot["results"]:
         versions = [
             VersionResponse(
                 id=r["id"],
                 audio_path=r["audio_path"],
                 metadata=r["metadata"]
             )
-            for r in job.results
+            for r in snapshot["results"]
         ]
     
     return JobStatusResponse(
         job_id=job_id,
-        status=job.status.value,
-        progress=job.progress,
-        current_step=job.current_step,
+        status=snapshot["status"],
+        progress=snapshot["progress"],
+        current_step=snapshot["current_step"],
         versions=versions,
-        error=job.error
+        error=snapshot["error"]
     )
 
 
@@ -534,75 +607,6 @@ async def get_provider_status_endpoint():
         )
 
 
-def _run_mistral_generation(
-    user_prompt: str,
-    system_prompt: Optional[str],
-    max_length: int,
-    temperature: float,
-    top_p: float,
-    do_sample: bool,
-    result_queue: multiprocessing.Queue,
-    error_queue: multiprocessing.Queue
-):
-    """
-    Run Mistral generation in a subprocess.
-    
-    This function runs in a separate process, loads the model, generates text,
-    and then exits, ensuring cleanup of model resources.
-    """
-    try:
-        # Import here to ensure it's in the subprocess context
-        from ..models.mistral_lyrics import MistralLyricsModel
-        
-        # Get configuration from environment
-        model_name = os.getenv("MISTRAL_MODEL_NAME", None)
-        device = os.getenv("DEVICE", "cpu")
-        
-        logger.info(f"Loading Mistral model in subprocess (device: {device})")
-        
-        # Create and initialize model in this subprocess
-        mistral_model = MistralLyricsModel(model_name=model_name, device=device)
-        
-        if not mistral_model.is_available():
-            error_queue.put("Mistral model is not available. Please check model service configuration.")
-            return
-        
-        logger.info("Generating lyrics with Mistral model...")
-        
-        # Generate lyrics
-        lyrics = mistral_model.generate(
-            user_prompt=user_prompt,
-            system_prompt=system_prompt,
-            max_length=max_length,
-            temperature=temperature,
-            top_p=top_p,
-            do_sample=do_sample
-        )
-        
-        # Clean up model resources explicitly
-        if hasattr(mistral_model, 'model') and mistral_model.model is not None:
-            del mistral_model.model
-        if hasattr(mistral_model, 'tokenizer') and mistral_model.tokenizer is not None:
-            del mistral_model.tokenizer
-        del mistral_model
-        
-        # Clear GPU cache if available
-        try:
-            import torch
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-        except ImportError:
-            pass
-        
-        # Put result in queue
-        result_queue.put(lyrics)
-        logger.info("Mistral generation completed, subprocess exiting")
-        
-    except Exception as e:
-        logger.error(f"Mistral generation failed in subprocess: {e}", exc_info=True)
-        error_queue.put(str(e))
-
-
 @router.post("/lyrics/generate", response_model=LyricsGenerationResponse)
 async def generate_lyrics(request: LyricsGenerationRequest):
     """
@@ -611,7 +615,7 @@ async def generate_lyrics(request: LyricsGenerationRequest):
     Accepts song context (prompt, duration, topic) and optionally existing lyrics
     for refinement. Returns generated or refined lyrics.
     
-    The Mistral model runs in a separate subprocess that is cleaned up after each request.
+    The Mistral model runs in a persistent worker subprocess that keeps it loaded between requests.
     """
     try:
         # Build system and user prompts for lyrics generation
@@ -654,67 +658,29 @@ REQUIREMENTS:
         
         logger.info(f"Generating lyrics with topic: {request.topic[:50]}...")
         
-        # Create queues for communication with subprocess
-        result_queue = multiprocessing.Queue()
-        error_queue = multiprocessing.Queue()
-        
-        # Start Mistral generation in subprocess
-        process = multiprocessing.Process(
-            target=_run_mistral_generation,
-            args=(
-                user_prompt,
-                system_prompt,
-                1024,  # max_length
-                0.9,   # temperature
-                0.9,   # top_p
-                True,  # do_sample
-                result_queue,
-                error_queue
-            ),
-            daemon=False  # Don't use daemon to allow proper cleanup
-        )
+        try:
+            lyrics = await mistral_worker.generate(
+                user_prompt=user_prompt,
+                system_prompt=system_prompt,
+                max_length=1024,
+                temperature=0.9,
+                top_p=0.9,
+                do_sample=True
+            )
+        except RuntimeError as e:
+            error_msg = str(e)
+            raise HTTPException(
+                status_code=503 if "not available" in error_msg else 500,
+                detail=error_msg
+            )
         
-        process.start()
-        process.join()  # Wait for the process to complete
+        if not lyrics:
+            raise HTTPException(
+                status_code=500,
+                detail="Generated lyrics are empty"
+            )
         
-        try:
-            # Check for errors
-            if not error_queue.empty():
-                error_msg = error_queue.get()
-                raise HTTPException(
-                    status_code=503 if "not available" in error_msg else 500,
-                    detail=error_msg
-                )
-            
-            # Get result
-            if result_queue.empty():
-                raise HTTPException(
-                    status_code=500,
-                    detail="Mistral generation completed but no result was returned"
-                )
-            
-            lyrics = result_queue.get()
-            
-            if not lyrics:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Generated lyrics are empty"
-                )
-            
-            return LyricsGenerationResponse(lyrics=lyrics)
-        finally:
-            # Clean up queues to prevent resource leaks
-            try:
-                result_queue.close()
-                result_queue.join_thread()
-            except Exception as e:
-                logger.warning(f"Error closing result_queue: {e}")
-            
-            try:
-                error_queue.close()
-                error_queue.join_thread()
-            except Exception as e:
-                logger.warning(f"Error closing error_queue: {e}")
+        return LyricsGenerationResponse(lyrics=lyrics)
     
     except HTTPException:
         raise
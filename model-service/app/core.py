@@ -16,7 +16,8 @@ _model_instances: Dict[str, Optional[BaseMusicModel]] = {
     "song-generation": None
 }
 _current_provider: Optional[str] = None
-# Note: Mistral model is no longer stored globally - it runs in subprocess per request
+# Note: Mistral model is not stored here - it runs in a persistent worker subprocess
+# (see app/services/mistral_worker.py)
 
 
 def _get_default_provider() -> str:
@@ -209,6 +210,6 @@ def get_provider_status() -> Dict[str, Any]:
 
 
 # Note: get_mistral_model() has been removed.
-# Mistral model now runs in a subprocess per request (see app/api/generation.py)
-# This ensures proper cleanup after each request.
+# Mistral model now runs in a persistent worker subprocess (see app/services/mistral_worker.py)
+# which is restarted after MISTRAL_WORKER_MAX_JOBS requests to release memory.
 
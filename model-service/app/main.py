@@ -2,11 +2,19 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import logging
 import os
+import shutil
+import time
+from pathlib import Path
 
 from .api import generation
 from .core import get_model
+from .models.ace_step import get_output_dir
+from .models.song_generation import get_output_dir as get_song_generation_output_dir
+from .services.generation_job import job_manager
+from .services.mistral_worker import mistral_worker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,6 +35,47 @@ app.add_middleware(
 )
 
 
+# Rendered audio older than this is removed to cap tmpfs usage
+OUTPUT_MAX_AGE_SECONDS = int(os.getenv("ACE_OUTPUT_MAX_AGE_MINUTES", 24 * 60)) * 60
+OUTPUT_SWEEP_INTERVAL_SECONDS = 300
+
+
+def _sweep_output_dir(output_dir: Path, max_age_seconds: int) -> int:
+    """Delete rendered files (and stale scratch directories) older than max_age_seconds. Returns the number removed."""
+    if not output_dir.is_dir():
+        return 0
+    
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in output_dir.iterdir():
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+            if path.is_file():
+                path.unlink()
+                removed += 1
+            elif path.is_dir():
+                # Scratch directories left behind by generation processes that were killed
+                shutil.rmtree(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Failed to remove old output {path}: {e}")
+    return removed
+
+
+async def _output_sweeper():
+    """Periodically prune old rendered audio from the output directories."""
+    while True:
+        await asyncio.sleep(OUTPUT_SWEEP_INTERVAL_SECONDS)
+        for output_dir in (get_output_dir(), get_song_generation_output_dir()):
+            try:
+                removed = await asyncio.to_thread(_sweep_output_dir, output_dir, OUTPUT_MAX_AGE_SECONDS)
+                if removed:
+                    logger.info(f"Removed {removed} old output(s) from {output_dir}")
+            except Exception as e:
+                logger.warning(f"Output sweep of {output_dir} failed: {e}")
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize models on startup."""
@@ -42,9 +91,24 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize music generation model: {e}")
     
-    # Note: Mistral model is no longer initialized on startup.
-    # It runs in a subprocess per request to ensure proper cleanup.
-    logger.info("Mistral lyrics model will be loaded in subprocess per request")
+    # Start the generation workers now; each loads the music model as it starts, in
+    # the process that runs the jobs. This doesn't hold up the API process, so a
+    # first-run checkpoint download can't outlast the gunicorn worker timeout.
+    try:
+        job_manager.start_workers(initializer=generation.warm_generation_worker)
+    except Exception as e:
+        logger.error(f"Failed to start generation workers: {e}")
+    
+    app.state.output_sweeper = asyncio.create_task(_output_sweeper())
+    # Old finished jobs are dropped in the background rather than on each create
+    job_manager.start_sweeper()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers on shutdown."""
+    mistral_worker.stop()
+    job_manager.shutdown()
 
 
 @app.get("/health")
@@ -65,6 +129,9 @@ app.include_router(generation.router, prefix="/model/v1", tags=["generation"])
 
 
 if __name__ == "__main__":
+    # Local development only. In production run under Gunicorn (see Dockerfile):
+    #   gunicorn app.main:app -k uvicorn.workers.UvicornWorker -w ${GUNICORN_WORKERS:-1} \
+    #       -b 0.0.0.0:${MODEL_SERVICE_PORT:-8001} --timeout 600 --keep-alive 30
     import uvicorn
     port = int(os.getenv("MODEL_SERVICE_PORT", 8001))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -3,10 +3,17 @@
 import os
 import uuid
 import tempfile
+import subprocess
+import contextlib
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Callable, Union
 import logging
+import time
 import torch
+from torch.nn.attention import SDPBackend, sdpa_kernel
 import threading
 import multiprocessing
 
@@ -14,6 +21,58 @@ from .base import BaseMusicModel
 
 logger = logging.getLogger(__name__)
 
+# Device availability and the pipeline class can't change within a process, so probe them once
+_HAS_CUDA = torch.cuda.is_available()
+_HAS_MPS = hasattr(torch.backends, "mps") and torch.backends.mps.is_available()
+
+try:
+    from acestep.pipeline_ace_step import ACEStepPipeline as _PIPELINE_CLS
+    _PIPELINE_IMPORT_ERROR: Optional[ImportError] = None
+except ImportError as e:
+    _PIPELINE_CLS = None
+    _PIPELINE_IMPORT_ERROR = e
+
+# Minimum seconds between progress callbacks from the diffusion/decoding loops
+PROGRESS_MIN_INTERVAL = 0.2
+
+# Number of shape-specialized compiled graphs kept per function when torch.compile is on.
+# Each distinct audio_duration / infer_step / cfg_type combination needs its own graph.
+COMPILED_GRAPH_CACHE_SIZE = 8
+
+# Maximum number of distinct prompts whose text-encoder outputs are kept in memory
+TEXT_EMBEDDING_CACHE_SIZE = 128
+
+# Shared pool for encoding renders (MP3, OGG, FLAC, ...) so the next version can
+# start diffusing while the previous one is still being encoded
+_ENCODE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1,
+    thread_name_prefix="ace-step-encode"
+)
+
+
+def get_output_dir() -> Path:
+    """
+    Resolve the directory ACE-Step renders into.
+    
+    Uses ACE_OUTPUT_DIR if set (e.g. a tmpfs such as /dev/shm to keep renders in
+    memory), otherwise the system temp directory.
+    """
+    env_dir = os.getenv("ACE_OUTPUT_DIR")
+    if env_dir:
+        return Path(env_dir)
+    return Path(tempfile.gettempdir()) / "ace_step_output"
+
+
+def _encode_audio(wav_path: Path, output_path: Path) -> str:
+    """Encode a rendered WAV file with ffmpeg (codec chosen from output_path's suffix) and remove the WAV."""
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", str(wav_path), str(output_path)],
+        check=True,
+        capture_output=True
+    )
+    wav_path.unlink(missing_ok=True)
+    return str(output_path)
+
 
 class CancelledError(Exception):
     """Exception raised when generation is cancelled."""
@@ -35,15 +94,16 @@ class ACEStepModel(BaseMusicModel):
         self.device = device
         self.model = None
         self._initialized = False
-        self.output_dir = Path(tempfile.gettempdir()) / "ace_step_output"
+        self._sdpa_backends: Optional[List[SDPBackend]] = None
+        self.output_dir = get_output_dir()
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
         # Validate device
-        if device == "cuda" and not torch.cuda.is_available():
+        if device == "cuda" and not _HAS_CUDA:
             logger.warning("CUDA requested but not available, falling back to CPU")
             self.device = "cpu"
         elif device == "mps":
-            if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+            if _HAS_MPS:
                 logger.info("Using MPS (Apple Silicon) device")
             else:
                 logger.warning("MPS requested but not available, falling back to CPU")
@@ -55,7 +115,8 @@ class ACEStepModel(BaseMusicModel):
             return
         
         try:
-            from acestep.pipeline_ace_step import ACEStepPipeline
+            if _PIPELINE_CLS is None:
+                raise _PIPELINE_IMPORT_ERROR
             
             logger.info("Loading ACE-Step model using ACEStepPipeline")
             
@@ -67,13 +128,46 @@ class ACEStepModel(BaseMusicModel):
             
             logger.info(f"Initializing ACEStepPipeline with dtype={dtype}, device={self.device}")
             
+            # Let cuDNN autotune kernels for the fixed diffusion shapes and allow TF32 matmuls
+            if self.device == "cuda":
+                torch.backends.cudnn.benchmark = True
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.backends.cudnn.allow_tf32 = True
+                torch.set_float32_matmul_precision("high")
+                
+                # Prefer fused flash / memory-efficient attention, keeping math as a fallback
+                # for shapes or dtypes the fused kernels don't support
+                torch.backends.cuda.enable_flash_sdp(True)
+                torch.backends.cuda.enable_mem_efficient_sdp(True)
+                self._sdpa_backends = [
+                    SDPBackend.FLASH_ATTENTION,
+                    SDPBackend.EFFICIENT_ATTENTION,
+                    SDPBackend.MATH,
+                ]
+            
+            # Optionally compile the pipeline's modules. On CUDA, Inductor additionally
+            # captures the steady-state denoising step as a CUDA graph and replays it,
+            # falling back to eager execution for shapes outside the graph cache.
+            torch_compile = os.getenv("ACE_STEP_TORCH_COMPILE", "false").lower() == "true"
+            if torch_compile:
+                import torch._dynamo
+                import torch._inductor.config
+                
+                torch._dynamo.config.cache_size_limit = COMPILED_GRAPH_CACHE_SIZE
+                if self.device == "cuda":
+                    torch._inductor.config.triton.cudagraphs = True
+                logger.info("torch.compile enabled for ACEStepPipeline")
+            
             # Initialize the pipeline (matching Modal example)
-            self.model = ACEStepPipeline(
+            self.model = _PIPELINE_CLS(
                 dtype=dtype,
+                torch_compile=torch_compile,
                 cpu_offload=False,
                 overlapped_decode=True
             )
             
+            self._cache_text_embeddings()
+            
             # Move to device if needed (ACEStepPipeline handles this internally, but we can verify)
             if hasattr(self.model, "to") and self.device != "cpu":
                 try:
@@ -93,6 +187,42 @@ class ACEStepModel(BaseMusicModel):
             logger.error(f"Failed to initialize ACE-Step model: {e}", exc_info=True)
             raise RuntimeError(f"Failed to initialize ACE-Step model: {e}")
     
+    def _cache_text_embeddings(self):
+        """
+        Memoize the pipeline's text encoder so repeated prompts skip its forward pass.
+        
+        Versions of the same request (and retries) share the prompt, so only the
+        first one pays for encoding it. Cached tensors stay on the model's device.
+        """
+        original = getattr(self.model, "get_text_embeddings", None)
+        if original is None:
+            logger.info("ACEStepPipeline has no get_text_embeddings; text embedding cache disabled")
+            return
+        
+        cache: "OrderedDict[str, Any]" = OrderedDict()
+        
+        def cached_get_text_embeddings(texts, *args, **kwargs):
+            key = hashlib.sha256(
+                repr((list(texts), args, sorted(kwargs.items()))).encode("utf-8")
+            ).hexdigest()
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+            
+            result = original(texts, *args, **kwargs)
+            cache[key] = result
+            if len(cache) > TEXT_EMBEDDING_CACHE_SIZE:
+                cache.popitem(last=False)
+            return result
+        
+        self.model.get_text_embeddings = cached_get_text_embeddings
+    
+    def _attention_context(self):
+        """Restrict scaled_dot_product_attention to the fused backends where configured."""
+        if self._sdpa_backends:
+            return sdpa_kernel(self._sdpa_backends, set_priority=True)
+        return contextlib.nullcontext()
+    
     def generate(
         self,
         prompt: str,
@@ -113,7 +243,7 @@ class ACEStepModel(BaseMusicModel):
             duration: Target duration in seconds
             lyrics: Optional lyrics for the music
             num_versions: Number of versions to generate
-            format: Output format ("wav" or "mp3")
+            format: Output format ("wav", or any format ffmpeg can encode such as "mp3", "ogg", "flac")
             manual_seeds: Optional seed for reproducibility
             progress_callback: Optional callback function(progress: float, step: str) for progress updates
             cancellation_event: Optional threading.Event or multiprocessing.Event to check for cancellation
@@ -140,6 +270,7 @@ class ACEStepModel(BaseMusicModel):
             raise CancelledError("Generation was cancelled before starting")
 
         results = []
+        encode_futures: List[Future] = []
         infer_step = kwargs.get("infer_step", 60)
         
         for i in range(num_versions):
@@ -149,6 +280,8 @@ class ACEStepModel(BaseMusicModel):
             
             version_id = str(uuid.uuid4())
             output_path = self.output_dir / f"{version_id}.{format}"
+            # The pipeline always renders WAV; encoding to other formats happens off the hot path
+            render_path = output_path.with_suffix(".wav")
             
             try:
                 logger.info(
@@ -165,7 +298,7 @@ class ACEStepModel(BaseMusicModel):
                 
                 # Generate audio using ACEStepPipeline with progress tracking
                 # We monkeypatch tqdm to intercept progress from the diffusion loops
-                with torch.no_grad():
+                with torch.inference_mode(), self._attention_context():
                     # Check cancellation before model call
                     if cancellation_event and cancellation_event.is_set():
                         raise CancelledError(f"Generation was cancelled during version {i+1}/{num_versions}")
@@ -189,6 +322,7 @@ class ACEStepModel(BaseMusicModel):
                             self.total = total
                             self.desc = desc or ""
                             self.n = 0
+                            self._last_emit = float("-inf")
                             
                             # Detect phase based on description or total
                             # Diffusion loops have larger totals (infer_steps), decoding is smaller (batch_size)
@@ -199,14 +333,18 @@ class ACEStepModel(BaseMusicModel):
                                 progress_state['phase'] = 'decoding'
                         
                         def __iter__(self):
-                            """Iterate and update progress on each step."""
+                            """Iterate and report progress, at most every PROGRESS_MIN_INTERVAL seconds."""
                             if self.iterable is None:
                                 return iter([])
                             
                             for idx, item in enumerate(self.iterable):
                                 self.n = idx + 1
                                 
-                                if progress_callback:
+                                now = time.perf_counter()
+                                if progress_callback and (
+                                    now - self._last_emit >= PROGRESS_MIN_INTERVAL or self.n == self.total
+                                ):
+                                    self._last_emit = now
                                     if progress_state['phase'] == 'diffusion':
                                         # Diffusion takes 90% of version progress
                                         step_progress = (self.n / self.total * 90.0) if self.total else 0
@@ -258,8 +396,8 @@ class ACEStepModel(BaseMusicModel):
                         audio_duration=duration,
                         prompt=prompt,
                         lyrics=lyrics,
-                        format=format,
-                        save_path=str(output_path),
+                        format="wav",
+                        save_path=str(render_path),
                         manual_seeds=manual_seeds,
                         # Parameters from Modal example
                         infer_step=infer_step,
@@ -279,6 +417,11 @@ class ACEStepModel(BaseMusicModel):
                         # Restore original tqdm
                         ace_pipeline_module.tqdm = original_tqdm
                     
+                    if render_path != output_path:
+                        encode_futures.append(
+                            _ENCODE_EXECUTOR.submit(_encode_audio, render_path, output_path)
+                        )
+                    
                     # Update progress: version complete
                     if progress_callback:
                         version_progress = 100.0
@@ -312,6 +455,19 @@ class ACEStepModel(BaseMusicModel):
                 logger.error(f"Failed to generate version {i+1}: {e}", exc_info=True)
                 raise RuntimeError(f"Failed to generate version {i+1}: {e}")
         
+        # Wait for every encode still running in the background before reporting a failure,
+        # so none is left writing, then drop the WAV renders a failed encode left behind
+        wait(encode_futures)
+        errors = [future.exception() for future in encode_futures if future.exception() is not None]
+        if errors:
+            for result in results:
+                Path(result["audio_path"]).with_suffix(".wav").unlink(missing_ok=True)
+            error = errors[0]
+            if isinstance(error, subprocess.CalledProcessError):
+                stderr = error.stderr.decode(errors="replace") if error.stderr else ""
+                raise RuntimeError(f"Failed to encode {format}: {stderr or error}")
+            raise RuntimeError(f"Failed to encode {format}: {error}")
+        
         # Final progress update
         if progress_callback:
             progress_callback(100.0, "All versions completed")
@@ -320,29 +476,22 @@ class ACEStepModel(BaseMusicModel):
     
     def is_available(self) -> bool:
         """Check if ACE-Step model is available."""
-        try:
-            # Check if required dependencies are installed
-            from acestep.pipeline_ace_step import ACEStepPipeline
-            import torch
-            
-            # Check if device is available if CUDA is requested
-            if self.device == "cuda" and not torch.cuda.is_available():
-                logger.warning("CUDA requested but not available")
-                return False
-            
-            # Check if MPS is available if MPS is requested
-            if self.device == "mps":
-                if not hasattr(torch.backends, "mps") or not torch.backends.mps.is_available():
-                    logger.warning("MPS requested but not available")
-                    return False
-            
-            return True
-        except ImportError as e:
-            logger.error(f"Required dependencies not installed: {e}")
+        # Check if required dependencies are installed
+        if _PIPELINE_CLS is None:
+            logger.error(f"Required dependencies not installed: {_PIPELINE_IMPORT_ERROR}")
             return False
-        except Exception as e:
-            logger.error(f"Error checking model availability: {e}")
+        
+        # Check if device is available if CUDA is requested
+        if self.device == "cuda" and not _HAS_CUDA:
+            logger.warning("CUDA requested but not available")
             return False
+        
+        # Check if MPS is available if MPS is requested
+        if self.device == "mps" and not _HAS_MPS:
+            logger.warning("MPS requested but not available")
+            return False
+        
+        return True
     
     def get_model_info(self) -> Dict[str, Any]:
         """Get information about the ACE-Step model."""
@@ -373,7 +522,7 @@ class ACEStepModel(BaseMusicModel):
             self.model = None
             
             # Clear GPU cache if CUDA is available
-            if torch.cuda.is_available():
+            if _HAS_CUDA:
                 torch.cuda.empty_cache()
                 logger.info("Cleared CUDA cache")
             
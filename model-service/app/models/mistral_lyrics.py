@@ -7,24 +7,65 @@ Model Options:
   Example: "mistralai/Mistral-7B-Instruct-v0.2" with 4-bit quantization (requires bitsandbytes)
 
 For quantized models, you can also set USE_QUANTIZATION=true and QUANTIZATION_BITS=4 or 8
-to enable automatic quantization (requires bitsandbytes library).
+to enable automatic quantization on CUDA (requires bitsandbytes library). 4-bit uses NF4
+weights with double quantization; 8-bit is supported but decodes noticeably slower.
 """
 
 import logging
 import os
-from typing import Optional
+import re
+import traceback
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Thread
+from typing import Any, Dict, Iterator, List, Optional
 import torch
 
 logger = logging.getLogger(__name__)
 
 # Try to import transformers, but make it optional
 try:
-    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
     TRANSFORMERS_AVAILABLE = True
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
     logger.warning("transformers library not available. Lyrics generation will not work.")
 
+# Chat template tokens that can survive skip_special_tokens decoding
+CHAT_TOKENS = (
+    "<|im_start|>",
+    "<|im_end|>",
+    "<|user|>",
+    "<|assistant|>",
+    "<|system|>",
+    "<|endoftext|>",
+    "<|end|>",
+    "<s>",
+    "</s>",
+)
+CHAT_TOKEN_RE = re.compile("|".join(map(re.escape, CHAT_TOKENS)))
+
+# Whitespace around line breaks; collapsing it strips every line and drops blank ones
+LINE_WHITESPACE_RE = re.compile(r"\s*\n\s*")
+
+# Fused attention kernels to try, in order, per device; None falls back to the model's default
+ATTN_IMPLEMENTATIONS = {
+    "cuda": ("flash_attention_2", "sdpa", None),
+}
+DEFAULT_ATTN_IMPLEMENTATIONS = ("sdpa", None)
+
+# Default weight dtype per device when MISTRAL_DTYPE is not set; any other device uses bfloat16
+DEFAULT_DTYPES = {
+    "cuda": "float16",
+    "mps": "float16",
+}
+
+# Number of distinct (system_prompt, user_prompt) pairs whose encoded inputs are cached
+PROMPT_CACHE_SIZE = 128
+
+# Number of distinct system prompts whose chat message dicts are kept for reuse
+SYSTEM_MESSAGE_CACHE_SIZE = 32
+
 
 class MistralLyricsModel:
     """Mistral model for generating and refining lyrics."""
@@ -45,6 +86,12 @@ class MistralLyricsModel:
         self.tokenizer = None
         self.model = None
         self._initialized = False
+        # Generation kwargs shared by every call, filled in once the tokenizer is loaded
+        self._base_gen_kwargs: Dict[str, Any] = {}
+        # Per-instance cache so cached inputs never outlive (or mix between) tokenizers
+        self._encode_prompt = lru_cache(maxsize=PROMPT_CACHE_SIZE)(self._encode_prompt_uncached)
+        # System prompt -> system message dict; templates only read messages, so sharing is safe
+        self._sys_msg_cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
     
     def _initialize(self):
         """Lazy initialization of the model."""
@@ -61,56 +108,192 @@ class MistralLyricsModel:
             # Load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_name,
-                trust_remote_code=True
+                trust_remote_code=True,
+                use_fast=True
             )
             
             # Set pad token if not present
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
-            # Load model with appropriate settings
-            if self.device == "cuda":
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    torch_dtype=torch.float16,
-                    device_map="auto",
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
-            elif self.device == "mps":
-                # MPS (Metal Performance Shaders on macOS)
-                # Use float32 for MPS as float16 can cause inf/nan issues in probability distributions
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    torch_dtype=torch.float16,
-                    device_map=None,
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
-                self.model = self.model.to(self.device)
-            else:
-                # CPU or other devices
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    torch_dtype=torch.float32,
-                    device_map=None,
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
+            # Decoder-only models must be left-padded so batched prompts end where generation starts
+            self.tokenizer.padding_side = "left"
+            
+            self._base_gen_kwargs = {
+                "pad_token_id": self.tokenizer.eos_token_id,
+                "eos_token_id": self.tokenizer.eos_token_id,
+            }
+            
+            if self.device == "cpu":
+                self._configure_cpu_threads()
+            
+            # Load model in reduced precision on every device (see DEFAULT_DTYPES)
+            dtype = self._resolve_dtype()
+            logger.info(f"Using dtype {dtype} for Mistral model")
+            # Quantized weights are placed by bitsandbytes via device_map, never moved with .to()
+            self.model = self._load_model(dtype, self._build_quantization_config())
+            if self.device != "cuda":
                 self.model = self.model.to(self.device)
             
+            # float16 on MPS can produce inf/nan in the sampling distribution, so only the
+            # output projection runs in float32 instead of upcasting the whole model
+            if self.device == "mps" and dtype == torch.float16:
+                self._upcast_lm_head()
+            
             self.model.eval()
+            
+            # Optionally compile the decoder forward; generate() itself stays eager since
+            # HF generation loops contain graph breaks
+            if os.getenv("MISTRAL_TORCH_COMPILE", "false").lower() == "true":
+                logger.info("Compiling Mistral model forward with torch.compile")
+                if self.device == "cuda":
+                    import torch._inductor.config
+                    torch._inductor.config.triton.cudagraphs = True
+                    # A static KV cache keeps decode shapes fixed so the compiled step can be
+                    # captured as a CUDA graph; eager decode is better off with the dynamic cache
+                    self.model.generation_config.cache_implementation = "static"
+                self.model.forward = torch.compile(
+                    self.model.forward,
+                    mode="reduce-overhead",
+                    fullgraph=False,
+                    dynamic=True
+                )
+                self._warm_up()
+            
             self._initialized = True
             logger.info("Mistral model loaded successfully")
             
         except Exception as e:
-            import traceback
             logger.error(f"Failed to load Mistral model: {e}")
             logger.error(f"Full traceback: {traceback.format_exc()}")
             self._initialized = False
     
-    def is_available(self) -> bool:
-        """Check if the model is available."""
+    def _configure_cpu_threads(self):
+        """Size PyTorch's thread pools for CPU decode so worker processes don't oversubscribe cores."""
+        num_threads = int(os.getenv("OMP_NUM_THREADS", max(1, (os.cpu_count() or 1) // 2)))
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before any inter-op parallel work has started in this process
+            logger.warning("Could not set inter-op threads; parallel work has already started")
+        
+        # oneDNN provides the fast bfloat16 CPU kernels
+        torch.backends.mkldnn.enabled = True
+        
+        logger.info(
+            f"CPU threads: intra-op={torch.get_num_threads()}, "
+            f"inter-op={torch.get_num_interop_threads()} (set OMP_NUM_THREADS to tune)"
+        )
+    
+    def _load_model(self, dtype: torch.dtype, quantization_config):
+        """Load the model with the fastest attention implementation it supports."""
+        attn_implementations = ATTN_IMPLEMENTATIONS.get(self.device, DEFAULT_ATTN_IMPLEMENTATIONS)
+        
+        for attn_implementation in attn_implementations:
+            kwargs = {"attn_implementation": attn_implementation} if attn_implementation else {}
+            try:
+                model = AutoModelForCausalLM.from_pretrained(
+                    self.model_name,
+                    torch_dtype=dtype,
+                    device_map="auto" if self.device == "cuda" else None,
+                    quantization_config=quantization_config,
+                    trust_remote_code=True,
+                    low_cpu_mem_usage=True,
+                    **kwargs
+                )
+            except (ImportError, ValueError) as e:
+                # flash-attn not installed, or the model doesn't support this implementation
+                if attn_implementation is None:
+                    raise
+                logger.info(f"Attention implementation '{attn_implementation}' unavailable: {e}")
+                continue
+            
+            logger.info(f"Loaded Mistral model with attention implementation: {attn_implementation or 'default'}")
+            return model
+    
+    def _resolve_dtype(self) -> torch.dtype:
+        """Get the weight dtype from MISTRAL_DTYPE or the per-device default."""
+        dtype_name = os.getenv("MISTRAL_DTYPE") or DEFAULT_DTYPES.get(self.device, "bfloat16")
+        dtype = getattr(torch, dtype_name, None)
+        if not isinstance(dtype, torch.dtype):
+            raise ValueError(f"Unsupported MISTRAL_DTYPE: {dtype_name}")
+        return dtype
+    
+    def _build_quantization_config(self):
+        """Build a bitsandbytes config from USE_QUANTIZATION / QUANTIZATION_BITS, or None."""
+        if os.getenv("USE_QUANTIZATION", "false").lower() != "true":
+            return None
+        
+        if self.device != "cuda":
+            logger.warning(f"USE_QUANTIZATION is only supported on CUDA, ignoring it on {self.device}")
+            return None
+        
+        from transformers import BitsAndBytesConfig
+        
+        bits = int(os.getenv("QUANTIZATION_BITS", "4"))
+        if bits == 4:
+            logger.info("Loading Mistral model with 4-bit NF4 quantization")
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16,
+                bnb_4bit_use_double_quant=True
+            )
+        if bits == 8:
+            logger.warning(
+                "QUANTIZATION_BITS=8: 8-bit bitsandbytes inference is significantly slower than "
+                "4-bit or float16. Use QUANTIZATION_BITS=4 unless 8-bit accuracy is required."
+            )
+            return BitsAndBytesConfig(load_in_8bit=True)
+        
+        raise ValueError(f"Unsupported QUANTIZATION_BITS: {bits} (expected 4 or 8)")
+    
+    def _upcast_lm_head(self):
+        """Run the LM head (logits -> softmax input) in float32."""
+        lm_head = self.model.get_output_embeddings()
+        if lm_head is None:
+            return
+        if getattr(self.model.config, "tie_word_embeddings", False):
+            # The weight is shared with the input embedding, which must stay in float16:
+            # give the head its own float32 copy and untie it so it isn't re-tied later
+            untied = torch.nn.Linear(
+                lm_head.in_features,
+                lm_head.out_features,
+                bias=lm_head.bias is not None,
+                device=lm_head.weight.device,
+                dtype=torch.float32
+            )
+            with torch.no_grad():
+                untied.weight.copy_(lm_head.weight)
+                if lm_head.bias is not None:
+                    untied.bias.copy_(lm_head.bias)
+            self.model.config.tie_word_embeddings = False
+            self.model.set_output_embeddings(untied)
+            lm_head = untied
+        else:
+            lm_head.to(torch.float32)
+        lm_head.register_forward_pre_hook(
+            lambda module, args: tuple(
+                arg.float() if torch.is_tensor(arg) and arg.is_floating_point() else arg
+                for arg in args
+            )
+        )
+    
+    def _warm_up(self):
+        """Run a tiny generation so compilation happens at load time, not on the first request."""
+        dummy_input_ids = torch.zeros((1, 8), dtype=torch.long, device=self.device)
+        with torch.inference_mode():
+            self.model.generate(
+                input_ids=dummy_input_ids,
+                attention_mask=torch.ones_like(dummy_input_ids),
+                max_new_tokens=4,
+                pad_token_id=self.tokenizer.eos_token_id
+            )
+        logger.info("Mistral model warm-up complete")
+    
+    def _ensure_available(self) -> bool:
+        """Load the model if needed and report whether it is usable."""
         if not TRANSFORMERS_AVAILABLE:
             return False
         
@@ -120,6 +303,10 @@ class MistralLyricsModel:
         except Exception:
             return False
     
+    def is_available(self) -> bool:
+        """Check if the model is available."""
+        return self._ensure_available()
+    
     def generate(
         self,
         user_prompt: str,
@@ -145,7 +332,8 @@ class MistralLyricsModel:
         Returns:
             Generated text
         """
-        if not self.is_available():
+        # _initialized is only set once model and tokenizer are loaded
+        if not self._initialized and not self._ensure_available():
             raise RuntimeError("Mistral model is not available")
         
         # Backward compatibility: if prompt is provided, use it as user_prompt
@@ -153,113 +341,261 @@ class MistralLyricsModel:
             user_prompt = prompt
         
         try:
-            # Build messages list for chat template
-            messages = []
-            
-            # Add system prompt if provided
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add user prompt
-            messages.append({"role": "user", "content": user_prompt})
-            
-            # Apply chat template to format the prompt correctly
-            formatted_prompt = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            
-            # Tokenize with proper attention mask generation
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=2048
-            ).to(self.device)
-            
-            # Validate generation parameters to avoid invalid probability distributions
-            if temperature <= 0:
-                logger.warning(f"Invalid temperature {temperature}, using default 0.7")
-                temperature = 0.7
-            if top_p <= 0 or top_p > 1:
-                logger.warning(f"Invalid top_p {top_p}, using default 0.9")
-                top_p = 0.9
-            
-            # Get input length for extracting generated tokens later
+            inputs = self._encode_prompt(system_prompt, user_prompt)
             input_length = inputs["input_ids"].shape[1]
             
-            # Generate
-            with torch.no_grad():
-                # For MPS, ensure we're using appropriate settings
-                generation_kwargs = {
-                    "max_new_tokens": max_length,
-                    "pad_token_id": self.tokenizer.eos_token_id,
-                    "eos_token_id": self.tokenizer.eos_token_id,
-                }
-                
-                if do_sample:
-                    generation_kwargs.update({
-                        "temperature": max(temperature, 0.01),  # Ensure temperature > 0
-                        "top_p": top_p,
-                        "do_sample": True,
-                    })
-                else:
-                    generation_kwargs["do_sample"] = False
-                
+            with torch.inference_mode():
                 outputs = self.model.generate(
                     **inputs,
-                    **generation_kwargs
+                    **self._build_generation_kwargs(max_length, temperature, top_p, do_sample)
                 )
             
-            # Extract only the newly generated tokens (skip the input tokens)
-            generated_token_ids = outputs[0][input_length:]
-            
-            # Decode only the generated tokens
+            # Decode only the new tokens, once
             generated_text = self.tokenizer.decode(
-                generated_token_ids,
+                outputs[0, input_length:],
                 skip_special_tokens=True
             )
             
-            # Clean up any remaining special tokens that might have been missed
-            # Common chat template tokens
-            chat_tokens = [
-                "<|im_start|>",
-                "<|im_end|>",
-                "<|user|>",
-                "<|assistant|>",
-                "<|system|>",
-                "<|endoftext|>",
-                "<|end|>",
-                "<s>",
-                "</s>",
+            return self._clean_generated_text(generated_text)
+            
+        except Exception as e:
+            logger.error(f"Failed to generate text: {e}")
+            raise RuntimeError(f"Text generation failed: {str(e)}")
+    
+    def generate_stream(
+        self,
+        user_prompt: str,
+        system_prompt: Optional[str] = None,
+        max_length: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True
+    ) -> Iterator[str]:
+        """
+        Generate text using the Mistral model, yielding decoded chunks as they are produced.
+        
+        For streaming callers only: chunks are raw decoder output without the
+        chat-token and whitespace cleanup generate() applies.
+        
+        Args:
+            user_prompt: User prompt/query for generation
+            system_prompt: Optional system prompt to set context and instructions
+            max_length: Maximum length of generated text
+            temperature: Sampling temperature
+            top_p: Nucleus sampling parameter
+            do_sample: Whether to use sampling
+            
+        Yields:
+            Decoded text chunks
+        """
+        if not self._initialized and not self._ensure_available():
+            raise RuntimeError("Mistral model is not available")
+        
+        inputs = self._encode_prompt(system_prompt, user_prompt)
+        generation_kwargs = self._build_generation_kwargs(max_length, temperature, top_p, do_sample)
+        
+        # skip_prompt drops the echoed input tokens so only new text is streamed
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        errors: List[Exception] = []
+        
+        def run_generation():
+            try:
+                with torch.inference_mode():
+                    self.model.generate(**inputs, **generation_kwargs, streamer=streamer)
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer waiting on the streamer
+                streamer.end()
+        
+        thread = Thread(target=run_generation, name="mistral-generate", daemon=True)
+        thread.start()
+        
+        for chunk in streamer:
+            yield chunk
+        
+        thread.join()
+        if errors:
+            raise errors[0]
+    
+    def generate_batch(
+        self,
+        user_prompts: List[str],
+        system_prompt: Optional[str] = None,
+        max_length: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True
+    ) -> List[str]:
+        """
+        Generate text for several user prompts in a single batched forward pass.
+        
+        Args:
+            user_prompts: User prompts/queries, one output is generated per prompt
+            system_prompt: Optional system prompt shared by all prompts
+            max_length: Maximum length of each generated text
+            temperature: Sampling temperature
+            top_p: Nucleus sampling parameter
+            do_sample: Whether to use sampling
+            
+        Returns:
+            Generated texts, in the same order as user_prompts
+        """
+        if not self._initialized and not self._ensure_available():
+            raise RuntimeError("Mistral model is not available")
+        
+        if not user_prompts:
+            return []
+        
+        try:
+            conversations = [
+                self._build_messages(system_prompt, user_prompt)
+                for user_prompt in user_prompts
             ]
             
-            for token in chat_tokens:
-                generated_text = generated_text.replace(token, "")
+            # Template, tokenize and left-pad every conversation in one tokenizer call
+            inputs = self.tokenizer.apply_chat_template(
+                conversations,
+                tokenize=True,
+                add_generation_prompt=True,
+                padding=True,
+                truncation=True,
+                max_length=2048,
+                return_tensors="pt",
+                return_dict=True
+            )
+            inputs = {key: self._to_device(value) for key, value in inputs.items()}
             
-            # Clean up any extra whitespace but preserve line breaks
-            lines = generated_text.split("\n")
-            cleaned_lines = []
-            for line in lines:
-                cleaned_line = line.strip()
-                if cleaned_line:  # Keep non-empty lines
-                    cleaned_lines.append(cleaned_line)
+            # With left padding every row's prompt ends at the same column
+            input_length = inputs["input_ids"].shape[1]
             
-            generated_text = "\n".join(cleaned_lines).strip()
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    **inputs,
+                    **self._build_generation_kwargs(max_length, temperature, top_p, do_sample)
+                )
             
-            return generated_text
+            generated_texts = self.tokenizer.batch_decode(
+                outputs[:, input_length:],
+                skip_special_tokens=True
+            )
+            
+            return [self._clean_generated_text(text) for text in generated_texts]
             
         except Exception as e:
-            logger.error(f"Failed to generate text: {e}")
-            raise RuntimeError(f"Text generation failed: {str(e)}")
+            logger.error(f"Failed to generate batch: {e}")
+            raise RuntimeError(f"Batch text generation failed: {str(e)}")
+    
+    def _build_generation_kwargs(
+        self,
+        max_length: int,
+        temperature: float,
+        top_p: float,
+        do_sample: bool
+    ) -> Dict[str, Any]:
+        """Build model.generate() keyword arguments, validating sampling parameters."""
+        if not do_sample:
+            # Pure greedy decode: leave out sampling parameters so no logits warpers are installed
+            return {
+                **self._base_gen_kwargs,
+                "max_new_tokens": max_length,
+                "do_sample": False,
+                "num_beams": 1,
+            }
+        
+        # Validate generation parameters to avoid invalid probability distributions
+        if temperature <= 0:
+            logger.warning(f"Invalid temperature {temperature}, using default 0.7")
+            temperature = 0.7
+        if top_p <= 0 or top_p > 1:
+            logger.warning(f"Invalid top_p {top_p}, using default 0.9")
+            top_p = 0.9
+        
+        return {
+            **self._base_gen_kwargs,
+            "max_new_tokens": max_length,
+            "temperature": max(temperature, 0.01),  # Ensure temperature > 0
+            "top_p": top_p,
+            "do_sample": True,
+        }
+    
+    def _to_device(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Move a tokenizer output tensor to the model device, skipping the no-op copy on CPU."""
+        if self.device == "cpu":
+            return tensor
+        return tensor.to(self.device, non_blocking=True)
+    
+    @staticmethod
+    def _clean_generated_text(generated_text: str) -> str:
+        """Strip leftover chat tokens and normalize whitespace in decoded output."""
+        # Clean up any remaining special tokens that might have been missed
+        generated_text = CHAT_TOKEN_RE.sub("", generated_text)
+        
+        # Clean up any extra whitespace but preserve line breaks
+        return LINE_WHITESPACE_RE.sub("\n", generated_text).strip()
+    
+    def _build_messages(self, system_prompt: Optional[str], user_prompt: str) -> List[Dict[str, str]]:
+        """Build the chat messages list for a prompt pair, reusing cached system messages."""
+        user_msg = {"role": "user", "content": user_prompt}
+        if not system_prompt:
+            return [user_msg]
+        
+        sys_msg = self._sys_msg_cache.get(system_prompt)
+        if sys_msg is None:
+            sys_msg = {"role": "system", "content": system_prompt}
+            self._sys_msg_cache[system_prompt] = sys_msg
+            if len(self._sys_msg_cache) > SYSTEM_MESSAGE_CACHE_SIZE:
+                self._sys_msg_cache.popitem(last=False)
+        else:
+            self._sys_msg_cache.move_to_end(system_prompt)
+        
+        return [sys_msg, user_msg]
+    
+    def _encode_prompt_uncached(self, system_prompt: Optional[str], user_prompt: str) -> Dict[str, torch.Tensor]:
+        """
+        Apply the chat template and tokenize a prompt pair.
+        
+        Wrapped in an LRU cache in __init__, so repeated prompts (e.g. client retries)
+        skip templating and tokenization entirely. Returned tensors are shared and
+        must not be modified.
+        """
+        messages = self._build_messages(system_prompt, user_prompt)
+        
+        # Template and tokenize in one pass instead of rendering a string and re-tokenizing it
+        encoded = self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            truncation=True,
+            max_length=2048,
+            padding=False,
+            return_tensors="pt",
+            return_dict=True
+        )
+        
+        # Older transformers releases ignore return_dict and return the bare input ids
+        if isinstance(encoded, torch.Tensor):
+            input_ids = encoded
+            # A single unpadded prompt attends to every token
+            attention_mask = torch.ones_like(input_ids)
+        else:
+            input_ids = encoded["input_ids"]
+            attention_mask = encoded["attention_mask"]
+        
+        return {
+            "input_ids": self._to_device(input_ids),
+            "attention_mask": self._to_device(attention_mask),
+        }
     
     def get_model_info(self) -> dict:
-        """Get information about the model."""
+        """Get information about the model without triggering a load; call is_available() to load eagerly."""
         return {
             "model_name": self.model_name,
             "device": self.device,
-            "available": self.is_available(),
+            "available": self._initialized and self.model is not None,
             "transformers_available": TRANSFORMERS_AVAILABLE
         }
 
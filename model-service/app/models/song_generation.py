@@ -11,22 +11,248 @@ For setup instructions, see: https://github.com/tencent-ailab/SongGeneration
 """
 
 import os
+import sys
 import uuid
 import tempfile
 import json
+import pickle
+import re
 import subprocess
 import shutil
+import importlib.util
+import io
+import queue
+import time
+from collections import deque
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Callable, Union
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Callable, Union
 import logging
 import torch
 import threading
-import multiprocessing
+
+if TYPE_CHECKING:
+    import multiprocessing.synchronize
 
 from .base import BaseMusicModel
 
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, downloads are not coordinated
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Device support can't change within a process, so probe it once
+_HAS_CUDA = torch.cuda.is_available()
+_HAS_MPS = hasattr(torch.backends, "mps") and torch.backends.mps.is_available()
+
+# Minimum compute capability for FlashAttention-2 kernels (Ampere)
+FLASH_ATTN_MIN_CAPABILITY = (8, 0)
+
+# How long an is_available() result is reused before the filesystem is probed again
+AVAILABILITY_CACHE_SECONDS = 60.0
+
+# Try to import huggingface_hub, but make it optional
+try:
+    from huggingface_hub import snapshot_download
+    HF_HUB_AVAILABLE = True
+except ImportError:
+    HF_HUB_AVAILABLE = False
+
+# Try to import orjson for faster JSONL encoding, but make it optional
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Hugging Face repo holding the ckpt/ and third_party/ runtime directories
+RUNTIME_REPO_ID = "lglg666/SongGeneration-Runtime"
+
+# Section tags that mark lyrics as already structured for LeVo
+_STRUCTURE_TAG_RE = re.compile(r"\[(?:Verse|Chorus|Bridge|Intro|Outro)\]")
+
+# Checkpoint files needed by LeVo (weights and configs)
+CHECKPOINT_PATTERNS = ["*.pt", "*.bin", "*.safetensors", "*.json", "*.yaml"]
+
+# Call LeVo's generate.py inside this process instead of spawning `sh generate.sh` per request
+IN_PROCESS = os.getenv("SONG_GENERATION_IN_PROCESS", "true").lower() == "true"
+
+
+def get_output_dir() -> Path:
+    """Resolve the directory SongGeneration audio is delivered to (SONG_GENERATION_OUTPUT_DIR or tmp)."""
+    env_dir = os.getenv("SONG_GENERATION_OUTPUT_DIR")
+    if env_dir:
+        return Path(env_dir)
+    return Path(tempfile.gettempdir()) / "song_generation_output"
+
+
+# Lines of script output kept for error messages
+OUTPUT_TAIL_LINES = 200
+
+# How often the script's output queue is checked for cancellation and process exit
+OUTPUT_POLL_INTERVAL = 0.5
+
+# Step counters in LeVo output: "step 12/500" or a tqdm bar's "| 12/500 ["
+PROGRESS_LINE_RE = re.compile(r"(?:step\s*|\|\s*)(\d+)\s*/\s*(\d+)", re.IGNORECASE)
+
+# Seconds without a parseable step counter before falling back to the approximate ticker
+PROGRESS_FALLBACK_DELAY = 10.0
+
+
+# First bytes of a Git LFS pointer file checked out in place of the real binary
+LFS_POINTER_PREFIX = b"version https://git-lfs.github.com"
+
+
+def _is_lfs_pointer(path: Path) -> bool:
+    """Check whether a file is a Git LFS pointer by sniffing its first bytes."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(128).startswith(LFS_POINTER_PREFIX)
+    except OSError:
+        return False
+
+
+def _write_jsonl(path: Path, entries: List[Dict[str, Any]]):
+    """Encode all entries as UTF-8 JSON lines and write them with a single write call."""
+    if ORJSON_AVAILABLE:
+        data = b"".join(orjson.dumps(entry) + b"\n" for entry in entries)
+    else:
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode("utf-8")
+    
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _pump_stream(stream, name: str, lines: "queue.Queue"):
+    """Forward lines from a subprocess pipe to a queue so the pipe never fills up; None marks EOF."""
+    for line in iter(stream.readline, ""):
+        lines.put((name, line.rstrip("\n")))
+    stream.close()
+    lines.put((name, None))
+
+
+@contextmanager
+def _working_directory(path: Path):
+    """Temporarily change the working directory; LeVo resolves ckpt/ and third_party/ relative to it."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextmanager
+def _levo_environment(repo_path: Path):
+    """
+    Temporarily apply the environment generate.sh sets up for LeVo: its PYTHONPATH
+    entries and TRANSFORMERS_CACHE. Both are restored on exit so the rest of the
+    process (and anything forked from it) keeps its own settings.
+    """
+    # Same search order as the PYTHONPATH exported by generate.sh
+    search_paths = [
+        str(repo_path / "codeclm" / "tokenizer"),
+        str(repo_path),
+        str(repo_path / "codeclm" / "tokenizer" / "Flow1dVAE"),
+    ]
+    added = [path for path in search_paths if path not in sys.path]
+    sys.path[:0] = added
+    
+    previous_cache = os.environ.get("TRANSFORMERS_CACHE")
+    if previous_cache is None:
+        os.environ["TRANSFORMERS_CACHE"] = str(repo_path / "third_party" / "hub")
+    try:
+        yield
+    finally:
+        if previous_cache is None:
+            os.environ.pop("TRANSFORMERS_CACHE", None)
+        for path in added:
+            if path in sys.path:
+                sys.path.remove(path)
+
+
+class _StepProgress:
+    """Map LeVo's step counters onto the 10-90% progress band reserved for rendering."""
+    
+    def __init__(self, num_versions: int, progress_callback: Optional[Callable[[float, str], None]]):
+        self.num_versions = num_versions
+        self.progress_callback = progress_callback
+        self.progress = 10.0
+        # LeVo renders entries one after another; a step counter that goes backwards starts the next one
+        self.finished_entries = 0
+        self.last_step = 0
+        self.last_parsed = time.monotonic()
+    
+    def feed(self, line: str):
+        """Parse one line of LeVo output and report progress if it carries a step counter."""
+        match = PROGRESS_LINE_RE.search(line)
+        if not match or int(match.group(2)) <= 0:
+            return
+        step, total = int(match.group(1)), int(match.group(2))
+        if step < self.last_step:
+            self.finished_entries = min(self.finished_entries + 1, self.num_versions - 1)
+        self.last_step = step
+        self.last_parsed = time.monotonic()
+        
+        done = (self.finished_entries + min(step / total, 1.0)) / self.num_versions
+        parsed_progress = 10.0 + 80.0 * done
+        if self.progress_callback and parsed_progress >= self.progress + 0.5:
+            self.progress = parsed_progress
+            self.progress_callback(
+                self.progress,
+                f"Generating version {self.finished_entries + 1}/{self.num_versions} (step {step}/{total})..."
+            )
+
+
+class _LineWriter(io.TextIOBase):
+    """Text stream that hands each line to a callback, splitting tqdm's \r redraws into lines too."""
+    
+    def __init__(self, on_line: Callable[[str], None]):
+        super().__init__()
+        self._on_line = on_line
+        self._pending = ""
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, text: str) -> int:
+        self._pending += text
+        *lines, self._pending = re.split(r"[\r\n]", self._pending)
+        for line in lines:
+            if line:
+                self._on_line(line)
+        return len(text)
+    
+    def drain(self):
+        """Hand over a trailing line that never got a newline."""
+        if self._pending:
+            self._on_line(self._pending)
+            self._pending = ""
+
+
+class _LineHandler(logging.Handler):
+    """Logging handler that hands each formatted message to a callback."""
+    
+    def __init__(self, on_line: Callable[[str], None]):
+        super().__init__()
+        self._on_line = on_line
+    
+    def emit(self, record: logging.LogRecord):
+        # Skip this module's own records, which would otherwise loop back through on_line
+        if record.name == __name__:
+            return
+        try:
+            self._on_line(record.getMessage())
+        except Exception:
+            self.handleError(record)
+
 
 class CancelledError(Exception):
     """Exception raised when generation is cancelled."""
@@ -54,6 +280,15 @@ class SongGenerationModel(BaseMusicModel):
         self.device = device
         self.model = None
         self._initialized = False
+        # (model_id, device) the loaded entrypoint was set up for; a mismatch forces a reload
+        self._model_fingerprint = None
+        # Whether tools/new_prompt.pt is an un-pulled Git LFS pointer; probed once in _initialize_model
+        self._lfs_pointer: Optional[bool] = None
+        # Whether LeVo can run with flash attention here; probed on first use (see _use_flash_attn)
+        self._flash_attn_supported: Optional[bool] = None
+        # Memoized is_available() result and when it was computed (time.monotonic)
+        self._available_cache: Optional[bool] = None
+        self._available_ts: float = 0.0
         
         # Path to the SongGeneration repository
         self.repo_path = Path(songgeneration_repo_path or os.getenv(
@@ -67,29 +302,45 @@ class SongGenerationModel(BaseMusicModel):
         # Path to runtime files (ckpt and third_party directories)
         self.runtime_path = None
         
-        self.output_dir = Path(tempfile.gettempdir()) / "song_generation_output"
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Created on first generate(); old files are pruned by the service's output sweeper
+        self.output_dir = get_output_dir()
         
         # Validate device
-        if device == "cuda" and not torch.cuda.is_available():
+        if device == "cuda" and not _HAS_CUDA:
             logger.warning("CUDA requested but not available, falling back to CPU")
             self.device = "cpu"
         elif device == "mps":
-            if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+            if _HAS_MPS:
                 logger.info("Using MPS (Apple Silicon) device")
             else:
                 logger.warning("MPS requested but not available, falling back to CPU")
                 self.device = "cpu"
+        
+        if self.device == "cuda":
+            # Must be in place before the allocator initializes; LeVo and generate.sh inherit it.
+            # Expandable segments keep the long-lived process from fragmenting between requests.
+            os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+            # Let cuDNN autotune kernels for repeated shapes and allow TF32 matmuls
+            torch.backends.cudnn.benchmark = True
+            torch.set_float32_matmul_precision("high")
     
     def _initialize_model(self):
         """
         Initialize the LeVo SongGeneration model.
         
-        This checks for the SongGeneration repository and sets up paths.
-        The actual model loading happens when generate() is called via the shell script.
+        This checks for the SongGeneration repository and sets up paths, then imports
+        LeVo's generate.py entrypoint into self.model (unless SONG_GENERATION_IN_PROCESS
+        is false). If the import fails, generate() falls back to running generate.sh.
+        
+        Runs once per (model_id, device); later calls reuse the loaded entrypoint.
         """
+        fingerprint = (self.model_id, self.device)
         if self._initialized:
-            return
+            if self._model_fingerprint == fingerprint:
+                return
+            logger.info(f"SongGeneration config changed to {fingerprint}, reloading")
+            self.model = None
+            self._initialized = False
         
         try:
             # Check if we have a local repository path
@@ -108,31 +359,26 @@ class SongGenerationModel(BaseMusicModel):
                 ckpt_dir = self.repo_path / "ckpt"
                 third_party_dir = self.repo_path / "third_party"
                 
+                if not ckpt_dir.exists() or not third_party_dir.exists():
+                    self._link_runtime_files(ckpt_dir, third_party_dir)
+                
                 if not ckpt_dir.exists() or not third_party_dir.exists():
                     logger.warning(
                         f"Runtime files not found. You need to download them:\n"
-                        f"  huggingface-cli download lglg666/SongGeneration-Runtime --local-dir ./runtime\n"
-                        f"  mv runtime/ckpt {self.repo_path}/ckpt\n"
-                        f"  mv runtime/third_party {self.repo_path}/third_party"
+                        f"  huggingface-cli download {RUNTIME_REPO_ID} --local-dir {self.repo_path}"
                     )
                 else:
                     self.runtime_path = self.repo_path
                 
                 # Check for Git LFS pointer files
                 tools_file = self.repo_path / "tools" / "new_prompt.pt"
-                if tools_file.exists():
-                    try:
-                        with open(tools_file, "r", encoding="utf-8") as f:
-                            first_line = f.readline()
-                            if "version https://git-lfs.github.com" in first_line:
-                                logger.warning(
-                                    f"Detected Git LFS pointer file at {tools_file}. "
-                                    f"The actual file needs to be downloaded.\n"
-                                    f"Run: cd {self.repo_path} && git lfs install && git lfs pull"
-                                )
-                    except (UnicodeDecodeError, Exception):
-                        # File is binary (good - it's the actual file, not a pointer)
-                        pass
+                self._lfs_pointer = _is_lfs_pointer(tools_file)
+                if self._lfs_pointer:
+                    logger.warning(
+                        f"Detected Git LFS pointer file at {tools_file}. "
+                        f"The actual file needs to be downloaded.\n"
+                        f"Run: cd {self.repo_path} && git lfs install && git lfs pull"
+                    )
                 
                 # Determine checkpoint path
                 checkpoint_name = self.model_id.split("/")[-1] if "/" in self.model_id else self.model_id
@@ -142,6 +388,8 @@ class SongGenerationModel(BaseMusicModel):
                 else:
                     # Try to find it in the repo or assume it needs to be downloaded
                     checkpoint_dir = self.repo_path / checkpoint_name.replace("-", "_")
+                    if not checkpoint_dir.exists():
+                        checkpoint_dir = self._download_checkpoint() or checkpoint_dir
                     if checkpoint_dir.exists():
                         self.checkpoint_path = checkpoint_dir
                     else:
@@ -153,6 +401,10 @@ class SongGenerationModel(BaseMusicModel):
                         )
                         # Still mark as initialized - we'll try to use it anyway
                         self.checkpoint_path = checkpoint_dir
+                
+                # Import the Python entrypoint once so generate() skips the shell + interpreter cold start
+                if IN_PROCESS:
+                    self.model = self._load_entrypoint()
             else:
                 # No repo path configured - provide helpful error
                 raise RuntimeError(
@@ -165,9 +417,7 @@ class SongGenerationModel(BaseMusicModel):
                     "   pip install -r requirements.txt\n"
                     "   pip install -r requirements_nodeps.txt --no-deps\n\n"
                     "3. Download runtime files:\n"
-                    "   huggingface-cli download lglg666/SongGeneration-Runtime --local-dir ./runtime\n"
-                    "   mv runtime/ckpt ckpt\n"
-                    "   mv runtime/third_party third_party\n\n"
+                    "   huggingface-cli download lglg666/SongGeneration-Runtime --local-dir .\n\n"
                     "4. Download model checkpoint:\n"
                     "   huggingface-cli download lglg666/SongGeneration-base --local-dir ./songgeneration_base\n\n"
                     "5. Set the repository path:\n"
@@ -176,6 +426,7 @@ class SongGenerationModel(BaseMusicModel):
                 )
             
             self._initialized = True
+            self._model_fingerprint = fingerprint
             logger.info(f"SongGeneration model initialized (repo: {self.repo_path})")
             
         except RuntimeError:
@@ -194,12 +445,16 @@ class SongGenerationModel(BaseMusicModel):
         format: str = "mp3",
         manual_seeds: Optional[int] = None,
         progress_callback: Optional[Callable[[float, str], None]] = None,
-        cancellation_event: Optional[Union[threading.Event, multiprocessing.Event]] = None,
+        cancellation_event: Optional[Union[threading.Event, "multiprocessing.synchronize.Event"]] = None,
         **kwargs
     ) -> List[Dict[str, Any]]:
         """
         Generate music using SongGeneration.
         
+        All versions are written to a single JSONL file and rendered by one
+        generate.sh invocation, so the LeVo checkpoint is loaded once per call
+        rather than once per version.
+        
         Args:
             prompt: Text description of the music
             duration: Target duration in seconds
@@ -231,246 +486,149 @@ class SongGenerationModel(BaseMusicModel):
         if cancellation_event and cancellation_event.is_set():
             raise CancelledError("Generation was cancelled before starting")
         
-        results = []
+        logger.info(
+            f"Generating {num_versions} version(s) with prompt: {prompt[:50]}... "
+            f"and lyrics: {lyrics[:50] if lyrics else ''}..."
+        )
+        
+        if progress_callback:
+            progress_callback(0.0, f"Preparing input for {num_versions} version(s)...")
+        
+        version_ids = [str(uuid.uuid4()) for _ in range(num_versions)]
+        
+        # Format lyrics with structure tags if not already formatted
+        formatted_lyrics = lyrics
+        if lyrics and not _STRUCTURE_TAG_RE.search(lyrics):
+            # Try to format lyrics with basic structure
+            lines = lyrics.strip().split("\n")
+            if lines:
+                formatted_lyrics = "[Verse]\n" + "\n".join(lines[:4])
+                if len(lines) > 4:
+                    formatted_lyrics += "\n[Chorus]\n" + "\n".join(lines[4:8])
+        
+        # Build descriptions from prompt
+        descriptions = prompt
+        if kwargs.get("genre"):
+            descriptions += f", {kwargs.get('genre')}"
+        if kwargs.get("bpm"):
+            descriptions += f", the bpm is {kwargs.get('bpm')}"
         
-        for i in range(num_versions):
-            # Check for cancellation before each version
-            if cancellation_event and cancellation_event.is_set():
-                raise CancelledError(f"Generation was cancelled during version {i+1}/{num_versions}")
+        # One JSONL entry per version; LeVo names each output after its idx
+        jsonl_entries = []
+        for version_id in version_ids:
+            jsonl_entry = {
+                "idx": version_id,
+                "gt_lyric": formatted_lyrics or "[Verse]\n" + prompt,
+                "descriptions": descriptions
+            }
             
-            version_id = str(uuid.uuid4())
-            output_path = self.output_dir / f"{version_id}.{format}"
+            # Add optional fields
+            if kwargs.get("prompt_audio_path"):
+                jsonl_entry["prompt_audio_path"] = kwargs.get("prompt_audio_path")
+            elif kwargs.get("auto_prompt_audio_type"):
+                jsonl_entry["auto_prompt_audio_type"] = kwargs.get("auto_prompt_audio_type")
             
-            try:
-                logger.info(
-                    f"Generating version {i+1}/{num_versions} with prompt: {prompt[:50]}... "
-                    f"and lyrics: {lyrics[:50] if lyrics else ''}..."
-                )
-                
-                # Calculate base progress for completed versions
-                base_progress = (i / num_versions) * 100
-                
-                # Update progress: starting version
-                if progress_callback:
-                    progress_callback(base_progress, f"Starting version {i+1}/{num_versions}")
-                
-                # Generate audio using LeVo SongGeneration
-                # LeVo requires JSONL input format and uses a shell script
-                    if progress_callback:
-                        version_progress = 10.0
-                        progress_callback(
-                            base_progress + (version_progress / num_versions),
-                        f"Preparing input for version {i+1}/{num_versions}..."
-                        )
-                    
-                    # Check cancellation before model call
-                    if cancellation_event and cancellation_event.is_set():
-                        raise CancelledError(f"Generation was cancelled during version {i+1}/{num_versions}")
-                    
-                # Create temporary JSONL file for this version
-                jsonl_file = self.output_dir / f"{version_id}_input.jsonl"
-                
-                # Format lyrics with structure tags if not already formatted
-                formatted_lyrics = lyrics
-                if lyrics and not any(tag in lyrics for tag in ["[Verse]", "[Chorus]", "[Bridge]", "[Intro]", "[Outro]"]):
-                    # Try to format lyrics with basic structure
-                    lines = lyrics.strip().split("\n")
-                    if lines:
-                        formatted_lyrics = "[Verse]\n" + "\n".join(lines[:4])
-                        if len(lines) > 4:
-                            formatted_lyrics += "\n[Chorus]\n" + "\n".join(lines[4:8])
-                
-                # Build descriptions from prompt
-                descriptions = prompt
-                if kwargs.get("genre"):
-                    descriptions += f", {kwargs.get('genre')}"
-                if kwargs.get("bpm"):
-                    descriptions += f", the bpm is {kwargs.get('bpm')}"
-                
-                # Create JSONL entry
-                jsonl_entry = {
-                    "idx": version_id,
-                    "gt_lyric": formatted_lyrics or "[Verse]\n" + prompt,
-                    "descriptions": descriptions
-                }
-                
-                # Add optional fields
-                if kwargs.get("prompt_audio_path"):
-                    jsonl_entry["prompt_audio_path"] = kwargs.get("prompt_audio_path")
-                elif kwargs.get("auto_prompt_audio_type"):
-                    jsonl_entry["auto_prompt_audio_type"] = kwargs.get("auto_prompt_audio_type")
+            jsonl_entries.append(jsonl_entry)
+        
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Per-call scratch space for the JSONL and LeVo's output, removed when the call ends.
+            # It lives under output_dir so moving the final audio out of it is a rename.
+            with tempfile.TemporaryDirectory(prefix="songgen_", dir=self.output_dir) as scratch:
+                scratch_dir = Path(scratch)
                 
                 # Write JSONL file
-                with open(jsonl_file, "w", encoding="utf-8") as f:
-                    f.write(json.dumps(jsonl_entry, ensure_ascii=False) + "\n")
+                jsonl_file = scratch_dir / "batch_input.jsonl"
+                _write_jsonl(jsonl_file, jsonl_entries)
                 
                 logger.info(f"Created JSONL input file: {jsonl_file}")
                 
-                if progress_callback:
-                    version_progress = 30.0
-                    progress_callback(
-                        base_progress + (version_progress / num_versions),
-                        f"Running SongGeneration for version {i+1}/{num_versions}..."
-                    )
-                
                 # Check cancellation
                 if cancellation_event and cancellation_event.is_set():
-                    raise CancelledError(f"Generation was cancelled during version {i+1}/{num_versions}")
+                    raise CancelledError("Generation was cancelled before running SongGeneration")
                 
-                # Prepare output directory for this version
-                version_output_dir = self.output_dir / version_id
-                version_output_dir.mkdir(parents=True, exist_ok=True)
+                # Prepare output directory shared by every version in the batch
+                batch_output_dir = scratch_dir / "output"
+                batch_output_dir.mkdir(parents=True, exist_ok=True)
                 
-                # Call generate.sh script
-                generate_script = self.repo_path / "generate.sh"
-                if not generate_script.exists():
-                    raise RuntimeError(f"generate.sh not found at {generate_script}")
-                
-                # Build command
-                cmd = [
-                    "sh",
-                    str(generate_script),
-                    str(self.checkpoint_path),
-                    str(jsonl_file),
-                    str(version_output_dir)
-                ]
-                
-                # Add optional flags
-                if kwargs.get("low_mem"):
-                    cmd.append("--low_mem")
-                if kwargs.get("not_use_flash_attn"):
-                    cmd.append("--not_use_flash_attn")
-                if kwargs.get("separate"):
-                    cmd.append("--separate")
-                elif kwargs.get("bgm"):
-                    cmd.append("--bgm")
-                elif kwargs.get("vocal"):
-                    cmd.append("--vocal")
-                
-                logger.info(f"Running command: {' '.join(cmd)}")
+                if progress_callback:
+                    progress_callback(10.0, f"Running SongGeneration for {num_versions} version(s)...")
                 
-                # Run the generation script
-                try:
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        cwd=str(self.repo_path),
-                        text=True
+                if self.model is not None:
+                    # In-process calls can't be interrupted; cancelling the job terminates its process
+                    self._run_entrypoint(
+                        jsonl_file,
+                        batch_output_dir,
+                        num_versions,
+                        progress_callback=progress_callback,
+                        **kwargs
                     )
-                    
-                    # Monitor process with cancellation support
-                    while process.poll() is None:
-                        if cancellation_event and cancellation_event.is_set():
-                            process.terminate()
-                            process.wait(timeout=5)
-                            raise CancelledError(f"Generation was cancelled during version {i+1}/{num_versions}")
-                        # Update progress periodically (this is approximate)
-                        if progress_callback:
-                            version_progress = min(version_progress + 5, 90.0)
-                            progress_callback(
-                                base_progress + (version_progress / num_versions),
-                                f"Generating version {i+1}/{num_versions}..."
-                            )
-                        import time
-                        time.sleep(1)
-                    
-                    # Check return code
-                    if process.returncode != 0:
-                        stderr_output = process.stderr.read() if process.stderr else "No error output"
-                        stdout_output = process.stdout.read() if process.stdout else ""
-                        
-                        # Check for common issues
-                        error_msg = f"SongGeneration script failed with return code {process.returncode}.\n"
-                        
-                        # Check for Git LFS pointer file issue
-                        if "invalid load key" in stderr_output or "UnpicklingError" in stderr_output:
-                            tools_file = self.repo_path / "tools" / "new_prompt.pt"
-                            if tools_file.exists():
-                                # Check if it's a Git LFS pointer
-                                try:
-                                    with open(tools_file, "r") as f:
-                                        first_line = f.readline()
-                                        if "version https://git-lfs.github.com" in first_line:
-                                            error_msg += (
-                                                "\n\nDetected Git LFS pointer file issue. "
-                                                "The tools/new_prompt.pt file is a Git LFS pointer, not the actual file.\n"
-                                                "To fix this, run:\n"
-                                                f"  cd {self.repo_path}\n"
-                                                "  git lfs install\n"
-                                                "  git lfs pull\n"
-                                                "\nOr download the file manually from the repository."
-                                            )
-                                except Exception:
-                                    pass
-                        
-                        error_msg += f"\n\nError output:\n{stderr_output}"
-                        if stdout_output:
-                            error_msg += f"\n\nStandard output:\n{stdout_output}"
-                        
-                        raise RuntimeError(error_msg)
-                    
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    raise RuntimeError("SongGeneration script timed out")
-                except FileNotFoundError:
-                    raise RuntimeError(
-                        f"Could not find generate.sh script. "
-                        f"Please ensure SONG_GENERATION_REPO_PATH is set correctly."
+                    if cancellation_event and cancellation_event.is_set():
+                        raise CancelledError("Generation was cancelled while running SongGeneration")
+                else:
+                    self._run_generate_script(
+                        jsonl_file,
+                        batch_output_dir,
+                        num_versions,
+                        progress_callback=progress_callback,
+                        cancellation_event=cancellation_event,
+                        **kwargs
                     )
                 
-                # Find the generated audio file
-                # LeVo typically outputs files with the idx as part of the name
-                generated_files = list(version_output_dir.glob(f"*{version_id}*"))
-                if not generated_files:
-                    # Try to find any audio files in the output directory
-                    generated_files = list(version_output_dir.glob("*.wav")) + list(version_output_dir.glob("*.mp3"))
+                if progress_callback:
+                    progress_callback(95.0, f"Collecting {num_versions} generated version(s)...")
                 
-                if not generated_files:
-                    raise RuntimeError(
-                        f"No output files found in {version_output_dir}. "
-                        f"Check the SongGeneration logs for errors."
-                    )
+                generated_by_id, audio_files = self._scan_output_dir(batch_output_dir, version_ids)
                 
-                # Use the first generated file (or handle multiple files if --separate was used)
-                generated_file = generated_files[0]
+                results = []
+                for i, version_id in enumerate(version_ids):
+                    output_path = self.output_dir / f"{version_id}.{format}"
                 
-                # Copy to final output path if needed
-                if generated_file != output_path:
-                    shutil.copy2(generated_file, output_path)
-                    logger.info(f"Copied generated file from {generated_file} to {output_path}")
+                    # LeVo typically outputs files with the idx as part of the name
+                    generated_file = generated_by_id.get(version_id)
+                    if generated_file is None and num_versions == 1 and audio_files:
+                        # A single-version batch can fall back to any audio file in the output directory
+                        generated_file = audio_files[0]
                 
-                    # Update progress: version complete
-                    if progress_callback:
-                        version_progress = 100.0
-                        progress_callback(
-                            base_progress + (version_progress / num_versions),
-                            f"Completed version {i+1}/{num_versions}"
+                    if generated_file is None:
+                        raise RuntimeError(
+                            f"No output files found for version {i+1} in {batch_output_dir}. "
+                            f"Check the SongGeneration logs for errors."
                         )
                 
-                logger.info(f"Generated audio saved to: {output_path}")
+                    # Move to final output path if needed; a rename is free on the same filesystem
+                    if generated_file != output_path:
+                        try:
+                            os.replace(generated_file, output_path)
+                            logger.info(f"Moved generated file from {generated_file} to {output_path}")
+                        except OSError:
+                            shutil.copy2(generated_file, output_path)
+                            logger.info(f"Copied generated file from {generated_file} to {output_path}")
+                
+                    logger.info(f"Generated audio saved to: {output_path}")
                 
-                results.append({
-                    "id": version_id,
-                    "audio_path": str(output_path),
-                    "metadata": {
-                        "prompt": prompt,
-                        "lyrics": lyrics,
-                        "duration": duration,
-                        "model": "song-generation",
-                        "version": i + 1,
-                        "format": format,
-                        "seed": manual_seeds,
-                        "model_id": self.model_id,
-                    }
-                })
+                    results.append({
+                        "id": version_id,
+                        "audio_path": str(output_path),
+                        "metadata": {
+                            "prompt": prompt,
+                            "lyrics": lyrics,
+                            "duration": duration,
+                            "model": "song-generation",
+                            "version": i + 1,
+                            "format": format,
+                            "seed": manual_seeds,
+                            "model_id": self.model_id,
+                        }
+                    })
                 
-            except CancelledError:
-                # Re-raise cancellation errors
-                raise
-            except Exception as e:
-                logger.error(f"Failed to generate version {i+1}: {e}", exc_info=True)
-                raise RuntimeError(f"Failed to generate version {i+1}: {e}")
+        except CancelledError:
+            # Re-raise cancellation errors
+            raise
+        except Exception as e:
+            logger.error(f"Failed to generate {num_versions} version(s): {e}", exc_info=True)
+            raise RuntimeError(f"Failed to generate {num_versions} version(s): {e}")
         
         # Final progress update
         if progress_callback:
@@ -478,8 +636,411 @@ class SongGenerationModel(BaseMusicModel):
         
         return results
     
+    def _run_generate_script(
+        self,
+        jsonl_file: Path,
+        output_dir: Path,
+        num_versions: int,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancellation_event: Optional[Union[threading.Event, "multiprocessing.synchronize.Event"]] = None,
+        **kwargs
+    ):
+        """
+        Run generate.sh once over a JSONL file, polling for cancellation.
+        
+        Args:
+            jsonl_file: JSONL input with one entry per version
+            output_dir: Directory LeVo writes the generated audio to
+            num_versions: Number of entries in the JSONL file (for progress messages)
+            progress_callback: Optional callback function(progress: float, step: str) for progress updates
+            cancellation_event: Optional threading.Event or multiprocessing.Event to check for cancellation
+            **kwargs: Generation parameters carrying optional generate.sh flags
+            
+        Raises:
+            RuntimeError: If the script fails
+            CancelledError: If generation is cancelled
+        """
+        # Call generate.sh script
+        generate_script = self.repo_path / "generate.sh"
+        if not generate_script.exists():
+            raise RuntimeError(f"generate.sh not found at {generate_script}")
+        
+        # Build command
+        cmd = [
+            "sh",
+            str(generate_script),
+            str(self.checkpoint_path),
+            str(jsonl_file),
+            str(output_dir)
+        ]
+        
+        # Add optional flags
+        if kwargs.get("low_mem"):
+            cmd.append("--low_mem")
+        if not self._use_flash_attn(kwargs):
+            cmd.append("--not_use_flash_attn")
+        if kwargs.get("separate"):
+            cmd.append("--separate")
+        elif kwargs.get("bgm"):
+            cmd.append("--bgm")
+        elif kwargs.get("vocal"):
+            cmd.append("--vocal")
+        
+        logger.info(f"Running command: {' '.join(cmd)}")
+        
+        # Run the generation script
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=str(self.repo_path),
+                text=True,
+                bufsize=1
+            )
+            
+            # Drain both pipes while the script runs; text mode splits tqdm's \r updates into lines
+            output_lines: "queue.Queue" = queue.Queue()
+            readers = [
+                threading.Thread(target=_pump_stream, args=(process.stdout, "stdout", output_lines), daemon=True),
+                threading.Thread(target=_pump_stream, args=(process.stderr, "stderr", output_lines), daemon=True),
+            ]
+            for reader in readers:
+                reader.start()
+            stdout_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+            stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+            open_streams = len(readers)
+            step_progress = _StepProgress(num_versions, progress_callback)
+            last_tick = time.monotonic()
+            
+            # Monitor process with cancellation support until both pipes hit EOF
+            while open_streams:
+                if cancellation_event and cancellation_event.is_set():
+                    process.terminate()
+                    process.wait(timeout=5)
+                    raise CancelledError("Generation was cancelled while running SongGeneration")
+                
+                try:
+                    stream_name, line = output_lines.get(timeout=OUTPUT_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+                else:
+                    if line is None:
+                        open_streams -= 1
+                        continue
+                    (stdout_tail if stream_name == "stdout" else stderr_tail).append(line)
+                    logger.debug(f"[SongGeneration {stream_name}] {line}")
+                    step_progress.feed(line)
+                
+                # Fall back to an approximate ticker while LeVo prints no step counters
+                now = time.monotonic()
+                if (
+                    progress_callback
+                    and now - step_progress.last_parsed >= PROGRESS_FALLBACK_DELAY
+                    and now - last_tick >= 1.0
+                ):
+                    last_tick = now
+                    step_progress.progress = min(step_progress.progress + 5 / num_versions, 90.0)
+                    progress_callback(step_progress.progress, f"Generating {num_versions} version(s)...")
+            
+            process.wait()
+            
+            # Check return code
+            if process.returncode != 0:
+                stderr_output = "\n".join(stderr_tail) or "No error output"
+                stdout_output = "\n".join(stdout_tail)
+                
+                # Check for common issues
+                error_msg = f"SongGeneration script failed with return code {process.returncode}.\n"
+                
+                # Check for Git LFS pointer file issue
+                if "invalid load key" in stderr_output or "UnpicklingError" in stderr_output:
+                    error_msg += self._lfs_pointer_hint()
+                
+                error_msg += f"\n\nError output:\n{stderr_output}"
+                if stdout_output:
+                    error_msg += f"\n\nStandard output:\n{stdout_output}"
+                
+                raise RuntimeError(error_msg)
+            
+        except subprocess.TimeoutExpired:
+            process.kill()
+            raise RuntimeError("SongGeneration script timed out")
+        except FileNotFoundError:
+            raise RuntimeError(
+                f"Could not find generate.sh script. "
+                f"Please ensure SONG_GENERATION_REPO_PATH is set correctly."
+            )
+    
+    def _lfs_pointer_hint(self) -> str:
+        """Explain an unpickling failure caused by an un-pulled Git LFS file, or return '' if that isn't the cause."""
+        if self._lfs_pointer is None:
+            self._lfs_pointer = _is_lfs_pointer(self.repo_path / "tools" / "new_prompt.pt")
+        if not self._lfs_pointer:
+            return ""
+        return (
+            "\n\nDetected Git LFS pointer file issue. "
+            "The tools/new_prompt.pt file is a Git LFS pointer, not the actual file.\n"
+            "To fix this, run:\n"
+            f"  cd {self.repo_path}\n"
+            "  git lfs install\n"
+            "  git lfs pull\n"
+            "\nOr download the file manually from the repository."
+        )
+    
+    def _use_flash_attn(self, kwargs: Dict[str, Any]) -> bool:
+        """
+        Decide whether LeVo should use flash attention for this request.
+        
+        On by default whenever the GPU and flash_attn package support it; otherwise
+        LeVo falls back to its standard attention instead of failing to load the kernel.
+        The not_use_flash_attn kwarg still forces it off.
+        """
+        if kwargs.get("not_use_flash_attn"):
+            return False
+        
+        if self._flash_attn_supported is None:
+            # Probed lazily so the CUDA context is created in the generation process, not at import
+            supported = False
+            if self.device == "cuda" and _HAS_CUDA:
+                capability = torch.cuda.get_device_capability()
+                if capability < FLASH_ATTN_MIN_CAPABILITY:
+                    logger.info(f"GPU compute capability {capability} is too old for flash attention")
+                elif importlib.util.find_spec("flash_attn") is None:
+                    logger.info("flash_attn is not installed, running LeVo without flash attention")
+                else:
+                    supported = True
+            self._flash_attn_supported = supported
+        
+        return self._flash_attn_supported
+    
+    @staticmethod
+    def _scan_output_dir(output_dir: Path, version_ids: List[str]):
+        """
+        Match generated files to version ids in a single directory pass.
+        
+        Args:
+            output_dir: Directory LeVo wrote the batch to
+            version_ids: Version ids used as JSONL idx values
+            
+        Returns:
+            Tuple of (version_id -> first file whose name contains it, all .wav/.mp3 files)
+        """
+        generated_by_id: Dict[str, Path] = {}
+        audio_files: List[Path] = []
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                for version_id in version_ids:
+                    if version_id in entry.name:
+                        generated_by_id.setdefault(version_id, Path(entry.path))
+                        break
+                if entry.name.endswith((".wav", ".mp3")):
+                    audio_files.append(Path(entry.path))
+        return generated_by_id, audio_files
+    
+    def _download_checkpoint(self) -> Optional[Path]:
+        """
+        Fetch the model checkpoint into the shared Hugging Face cache.
+        
+        snapshot_download honors HF_HOME / HF_HUB_CACHE, so containers that mount
+        the standard cache volume reuse an existing download instead of fetching
+        another copy into the repository.
+        
+        Returns:
+            Path to the cached snapshot, or None if it could not be downloaded
+        """
+        if not HF_HUB_AVAILABLE:
+            return None
+        try:
+            logger.info(f"Resolving checkpoint {self.model_id} from the Hugging Face cache")
+            return Path(snapshot_download(repo_id=self.model_id, allow_patterns=CHECKPOINT_PATTERNS))
+        except Exception as e:
+            logger.warning(f"Could not download checkpoint {self.model_id}: {e}")
+            return None
+    
+    @contextmanager
+    def _runtime_lock(self):
+        """Hold an exclusive lock on the repository so only one process fetches the runtime files."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.repo_path / ".runtime.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _link_runtime_files(self, ckpt_dir: Path, third_party_dir: Path):
+        """
+        Download the runtime repo into the Hugging Face cache and symlink its directories into the repository.
+        
+        Runs under a file lock: replicas starting together wait for the first one's
+        download and then find the links already in place.
+        """
+        if not HF_HUB_AVAILABLE:
+            return
+        try:
+            with self._runtime_lock():
+                if ckpt_dir.exists() and third_party_dir.exists():
+                    return
+                logger.info(f"Resolving {RUNTIME_REPO_ID} from the Hugging Face cache")
+                runtime_dir = Path(snapshot_download(repo_id=RUNTIME_REPO_ID))
+                for link, name in ((ckpt_dir, "ckpt"), (third_party_dir, "third_party")):
+                    if not link.exists() and (runtime_dir / name).exists():
+                        link.symlink_to(runtime_dir / name, target_is_directory=True)
+                        logger.info(f"Linked {link} -> {runtime_dir / name}")
+        except Exception as e:
+            logger.warning(f"Could not download runtime files from {RUNTIME_REPO_ID}: {e}")
+    
+    def _load_entrypoint(self):
+        """
+        Import LeVo's generate.py so it can be called without spawning a shell and interpreter.
+        
+        Reproduces the environment generate.sh sets up (PYTHONPATH entries and
+        TRANSFORMERS_CACHE) for the duration of the import only.
+        
+        Returns:
+            The imported module, or None if it could not be imported
+        """
+        entrypoint_file = self.repo_path / "generate.py"
+        if not entrypoint_file.exists():
+            logger.warning(f"generate.py not found at {entrypoint_file}, using generate.sh")
+            return None
+        
+        try:
+            with _levo_environment(self.repo_path), _working_directory(self.repo_path):
+                spec = importlib.util.spec_from_file_location("levo_generate", entrypoint_file)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+        except Exception as e:
+            logger.warning(f"Could not import LeVo entrypoint, using generate.sh instead: {e}", exc_info=True)
+            return None
+        
+        if not hasattr(module, "parse_args") or not hasattr(module, "generate"):
+            logger.warning(f"{entrypoint_file} has no parse_args()/generate() entrypoint, using generate.sh")
+            return None
+        
+        logger.info(f"Loaded LeVo entrypoint from {entrypoint_file}")
+        return module
+    
+    def _run_entrypoint(
+        self,
+        jsonl_file: Path,
+        output_dir: Path,
+        num_versions: int,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        **kwargs
+    ):
+        """
+        Run the imported LeVo entrypoint over a JSONL file.
+        
+        Arguments are parsed by LeVo's own parser from the argv generate.sh would
+        build, so flag handling stays identical to the script path. LeVo's printed
+        output and log records are parsed for step counters like the script's.
+        
+        Args:
+            jsonl_file: JSONL input with one entry per version
+            output_dir: Directory LeVo writes the generated audio to
+            num_versions: Number of entries in the JSONL file (for progress messages)
+            progress_callback: Optional callback function(progress: float, step: str) for progress updates
+            **kwargs: Generation parameters carrying optional generate.sh flags
+        """
+        if kwargs.get("separate"):
+            generate_type = "separate"
+        elif kwargs.get("bgm"):
+            generate_type = "bgm"
+        elif kwargs.get("vocal"):
+            generate_type = "vocal"
+        else:
+            generate_type = "mixed"
+        
+        argv = [
+            "generate.py",
+            "--ckpt_path", str(self.checkpoint_path),
+            "--input_jsonl", str(jsonl_file),
+            "--save_dir", str(output_dir),
+            "--generate_type", generate_type,
+        ]
+        if self._use_flash_attn(kwargs):
+            argv.append("--use_flash_attn")
+        low_mem = bool(kwargs.get("low_mem"))
+        if low_mem:
+            argv.append("--low_mem")
+        
+        logger.info(f"Running LeVo entrypoint in-process: {' '.join(argv)}")
+        
+        step_progress = _StepProgress(num_versions, progress_callback)
+        
+        def on_line(line: str):
+            logger.debug(f"[SongGeneration] {line}")
+            step_progress.feed(line)
+        
+        output = _LineWriter(on_line)
+        log_handler = _LineHandler(on_line)
+        root_logger = logging.getLogger()
+        saved_argv = sys.argv
+        saved_cwd = os.getcwd()
+        sys.argv = argv
+        root_logger.addHandler(log_handler)
+        try:
+            with _levo_environment(self.repo_path), redirect_stdout(output), redirect_stderr(output):
+                os.chdir(self.repo_path)
+                args = self.model.parse_args()
+                if low_mem and hasattr(self.model, "generate_lowmem"):
+                    self.model.generate_lowmem(args)
+                else:
+                    self.model.generate(args)
+                output.drain()
+        except SystemExit as e:
+            # argparse exits on unrecognized arguments; don't let that take down the worker
+            raise RuntimeError(f"LeVo entrypoint exited with code {e.code}")
+        except pickle.UnpicklingError as e:
+            raise RuntimeError(f"LeVo failed to load a checkpoint: {e}{self._lfs_pointer_hint()}")
+        finally:
+            root_logger.removeHandler(log_handler)
+            sys.argv = saved_argv
+            os.chdir(saved_cwd)
+    
+    def warm(self) -> bool:
+        """
+        Load the model ahead of the first request.
+        
+        Returns:
+            True if the model is ready, False if it isn't available
+        """
+        if not self.is_available():
+            return False
+        try:
+            self._initialize_model()
+        except RuntimeError as e:
+            logger.warning(f"SongGeneration warm-up failed: {e}")
+            return False
+        return True
+    
     def is_available(self) -> bool:
-        """Check if SongGeneration model is available."""
+        """
+        Check if SongGeneration model is available.
+        
+        The result is reused for AVAILABILITY_CACHE_SECONDS; call reset() to force a re-check.
+        """
+        now = time.monotonic()
+        if self._available_cache is not None and now - self._available_ts < AVAILABILITY_CACHE_SECONDS:
+            return self._available_cache
+        
+        self._available_cache = self._check_available()
+        self._available_ts = now
+        return self._available_cache
+    
+    def reset(self):
+        """Drop the memoized is_available() result."""
+        self._available_cache = None
+        self._available_ts = 0.0
+    
+    def _check_available(self) -> bool:
+        """Probe the repository, runtime files and device for availability."""
         try:
             # Check if repository path is configured
             if not self.repo_path or not self.repo_path.exists():
@@ -503,15 +1064,14 @@ class SongGenerationModel(BaseMusicModel):
                 logger.warning(f"Model checkpoint not found at {self.checkpoint_path}")
             
             # Check if device is available if CUDA is requested
-            if self.device == "cuda" and not torch.cuda.is_available():
+            if self.device == "cuda" and not _HAS_CUDA:
                 logger.warning("CUDA requested but not available")
                 return False
             
             # Check if MPS is available if MPS is requested
-            if self.device == "mps":
-                if not hasattr(torch.backends, "mps") or not torch.backends.mps.is_available():
-                    logger.warning("MPS requested but not available")
-                    return False
+            if self.device == "mps" and not _HAS_MPS:
+                logger.warning("MPS requested but not available")
+                return False
             
             return True
         except Exception as e:
@@ -545,10 +1105,11 @@ class SongGenerationModel(BaseMusicModel):
             self.model = None
             
             # Clear GPU cache if CUDA is available
-            if torch.cuda.is_available():
+            if _HAS_CUDA:
                 torch.cuda.empty_cache()
                 logger.info("Cleared CUDA cache")
             
             self._initialized = False
+            self._model_fingerprint = None
             logger.info("SongGeneration model resources cleaned up")
 
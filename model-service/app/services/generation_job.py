@@ -1,11 +1,20 @@
 """Background generation job management service."""
 
+import heapq
+import os
+import signal
 import uuid
-import multiprocessing
+import struct
 import threading
-from typing import Dict, Optional, Callable
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Callable, Tuple
 from enum import Enum
 from datetime import datetime
+from functools import partial
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,9 +29,216 @@ class JobStatus(str, Enum):
     CANCELLED = "cancelled"
 
 
+# Status <-> int mapping for ring buffer records
+_STATUS_CODES = {status: code for code, status in enumerate(JobStatus)}
+_STATUS_BY_CODE = list(JobStatus)
+
+# Maximum encoded length of the current step description in a ring buffer record
+STEP_MAX_BYTES = 256
+
+# Number of progress updates the ring buffer holds before the producer starts dropping them
+PROGRESS_RING_SIZE = 64
+
+# Minimum time between progress updates a generation task pushes for the same step
+PROGRESS_MIN_INTERVAL_SECONDS = 0.1
+
+# Times a job's task is submitted in all; a task lost to a broken worker pool (before it
+# started, or restarted because another job's worker was stopped) is resubmitted until then
+MAX_TASK_ATTEMPTS = 3
+
+# Status code in a ring record meaning "status unchanged"
+_NO_STATUS = 0xFF
+
+
+# One record drained from a job's progress ring buffer; status is None when unchanged
+ProgressUpdate = namedtuple("ProgressUpdate", "progress status step")
+
+# Final status update returned by a generation task; unset fields are None
+JobOutcome = namedtuple("JobOutcome", "status progress step results error", defaults=(None, None, None, None))
+
+
+def _encode_step(step: str) -> bytes:
+    """Encode a step description, truncated on a character boundary to fit STEP_MAX_BYTES."""
+    encoded = step.encode("utf-8")[:STEP_MAX_BYTES - 1]
+    return encoded.decode("utf-8", errors="ignore").encode("utf-8")
+
+
+class CancellationFlag:
+    """
+    Cancellation flag stored in one byte of a job's ring buffer header.
+    
+    Offers the set()/is_set() subset of the Event interface that the models check;
+    each is a single byte store or load on shared memory, with no semaphore.
+    """
+    
+    def __init__(self, shm: shared_memory.SharedMemory, offset: int):
+        """
+        Wrap a byte of an existing shared memory block.
+        
+        Args:
+            shm: Shared memory block holding the flag
+            offset: Offset of the flag byte in the block
+        """
+        self._shm = shm
+        self._offset = offset
+    
+    def set(self):
+        """Request cancellation."""
+        self._shm.buf[self._offset] = 1
+    
+    def is_set(self) -> bool:
+        """Check whether cancellation was requested."""
+        return self._shm.buf[self._offset] != 0
+
+
+class ProgressRing:
+    """
+    Single-producer/single-consumer ring buffer of progress updates in shared memory.
+    
+    The generation process pushes fixed-size (progress, status, step) records and
+    the API process drains them, with no pickling, pipe or lock on the way. The
+    header holds the head (consumer) and tail (producer) counters; each side only
+    ever writes its own counter, and the producer publishes a record by storing
+    the new tail after the record bytes are written. The header also records the
+    PID of the worker process running the task and holds the job's cancellation flag.
+    
+    Results and errors don't fit in a fixed record and come back as the task's
+    return value instead.
+    """
+    
+    # head, tail, worker PID, cancellation flag (low byte; padded to keep records aligned)
+    _HEADER = struct.Struct("=QQQQ")
+    _RECORD = struct.Struct(f"=dB{STEP_MAX_BYTES}s")
+    _TAIL_OFFSET = 8
+    _PID_OFFSET = 16
+    _CANCEL_OFFSET = 24
+    
+    def __init__(self, capacity: int = PROGRESS_RING_SIZE):
+        """
+        Allocate the ring buffer.
+        
+        Args:
+            capacity: Number of records the ring can hold
+        """
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(
+            create=True,
+            size=self._HEADER.size + capacity * self._RECORD.size
+        )
+        self._HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0)
+    
+    def push(self, progress: float, step: str = "", status: Optional[JobStatus] = None) -> bool:
+        """
+        Append a progress update. Producer side only.
+        
+        Args:
+            progress: Progress percentage (0-100)
+            step: Current step description (empty to leave it unchanged)
+            status: New job status, or None to leave it unchanged
+            
+        Returns:
+            False if the ring was full and the update was dropped
+        """
+        buf = self._shm.buf
+        head, tail, _, _ = self._HEADER.unpack_from(buf, 0)
+        if tail - head >= self.capacity:
+            return False
+        
+        offset = self._HEADER.size + (tail % self.capacity) * self._RECORD.size
+        code = _NO_STATUS if status is None else _STATUS_CODES[JobStatus(status)]
+        self._RECORD.pack_into(buf, offset, progress, code, _encode_step(step))
+        struct.pack_into("=Q", buf, self._TAIL_OFFSET, tail + 1)
+        return True
+    
+    def drain(self) -> List[ProgressUpdate]:
+        """
+        Remove and return all published updates, oldest first. Consumer side only.
+        
+        Returns:
+            List of ProgressUpdate records
+        """
+        buf = self._shm.buf
+        head, tail, _, _ = self._HEADER.unpack_from(buf, 0)
+        updates = []
+        for index in range(head, tail):
+            offset = self._HEADER.size + (index % self.capacity) * self._RECORD.size
+            progress, code, step = self._RECORD.unpack_from(buf, offset)
+            status = None if code == _NO_STATUS else _STATUS_BY_CODE[code]
+            updates.append(ProgressUpdate(progress, status, step.rstrip(b"\0").decode("utf-8", errors="ignore")))
+        struct.pack_into("=Q", buf, 0, tail)
+        return updates
+    
+    @property
+    def cancellation_flag(self) -> CancellationFlag:
+        """The job's cancellation flag, stored in this ring's header."""
+        return CancellationFlag(self._shm, self._CANCEL_OFFSET)
+    
+    def set_worker_pid(self, pid: int):
+        """Record the PID of the worker process running the task. Producer side only."""
+        struct.pack_into("=Q", self._shm.buf, self._PID_OFFSET, pid)
+    
+    @property
+    def worker_pid(self) -> int:
+        """PID of the worker process running the task, or 0 if it hasn't started."""
+        return struct.unpack_from("=Q", self._shm.buf, self._PID_OFFSET)[0]
+    
+    def close(self, unlink: bool = False):
+        """
+        Detach from the shared memory block.
+        
+        Args:
+            unlink: Also free the block; only the process that created it should do this
+        """
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class ThrottledProgress:
+    """
+    Rate-limits a generation task's progress updates into its ring buffer.
+    
+    Updates for the same step are pushed at most once per min_interval and the ones
+    in between are dropped; the task's final outcome carries the last progress
+    anyway. Status changes and new step descriptions are always pushed.
+    """
+    
+    def __init__(self, ring: ProgressRing, min_interval: float = PROGRESS_MIN_INTERVAL_SECONDS):
+        """
+        Initialize the throttle.
+        
+        Args:
+            ring: Ring buffer to push updates into
+            min_interval: Minimum seconds between pushed updates for the same step
+        """
+        self.ring = ring
+        self.min_interval = min_interval
+        self._last_push = float("-inf")
+        self._last_step: Optional[str] = None
+    
+    def __call__(self, progress: float, step: str = "", status: Optional[JobStatus] = None):
+        """Record a progress update, pushing it if it's due."""
+        now = time.monotonic()
+        if status is None and step == self._last_step and now - self._last_push < self.min_interval:
+            return
+        self.ring.push(progress, step, status)
+        self._last_push = now
+        self._last_step = step
+
+
 class GenerationJob:
     """Represents a background generation job."""
     
+    # Jobs can pile up by the thousand between sweeps; slots keep them small
+    __slots__ = (
+        "job_id", "prompt", "duration", "lyrics", "num_versions", "format",
+        "manual_seeds", "kwargs", "created_at", "completed_at", "completed_at_monotonic",
+        "_static_dict", "_status", "_progress", "_current_step", "_results", "_error",
+        "cancellation_event", "progress_ring", "future", "_pool", "_attempts",
+        "_restart_on_break", "_outcome_applied", "lock",
+        "version", "_snapshot", "on_terminal",
+    )
+    
     def __init__(
         self,
         job_id: str,
@@ -58,88 +274,100 @@ class GenerationJob:
         
         self.created_at = datetime.now()
         self.completed_at = None
+        # Monotonic completion time for expiry math; completed_at is for display
+        self.completed_at_monotonic: Optional[float] = None
+        
+        # Fields of to_dict() that never change after construction
+        self._static_dict = {
+            "job_id": self.job_id,
+            "prompt": self.prompt,
+            "duration": self.duration,
+            "lyrics": self.lyrics,
+            "num_versions": self.num_versions,
+            "format": self.format,
+            "manual_seeds": self.manual_seeds,
+            "created_at": self.created_at.isoformat(),
+        }
+        
+        # Job state lives in the API process. The generation task reports progress
+        # through the ring buffer and its outcome through the future it runs under.
+        self._status = JobStatus.PENDING
+        self._progress = 0.0
+        self._current_step = ""
+        self._results = None
+        self._error: Optional[str] = None
+        self.progress_ring = ProgressRing()
+        self.cancellation_event = self.progress_ring.cancellation_flag
+        self.future: Optional[Future] = None
+        # Pool the current task was submitted to, and whether it should be resubmitted
+        # if that pool breaks because a worker was stopped deliberately
+        self._pool = None
+        self._attempts = 0
+        self._restart_on_break = False
+        self._outcome_applied = False
+        # Only ever taken in the API process, so a plain thread lock is enough
+        self.lock = threading.Lock()
         
-        # Multiprocessing primitives - use Manager for shared state
-        self.manager = multiprocessing.Manager()
-        self.shared_state = self.manager.dict({
-            "status": JobStatus.PENDING.value,
-            "progress": 0.0,
-            "current_step": "",
-            "results": None,
-            "error": None,
-            "completed_at": None
-        })
-        self.cancellation_event = multiprocessing.Event()
-        self.progress_queue = multiprocessing.Queue()
-        self.process: Optional[multiprocessing.Process] = None
-        self.lock = multiprocessing.Lock()
+        # Bumped on every state change; to_dict() is served from a cached snapshot
+        # until it moves, and the API uses it as an ETag
+        self.version = 0
+        self._snapshot: Optional[Dict] = None
+        
+        # Called once (with self.lock held) when the job first reaches a terminal status
+        self.on_terminal: Optional[Callable[["GenerationJob"], None]] = None
     
     @property
     def status(self) -> JobStatus:
-        """Get job status from shared state."""
-        return JobStatus(self.shared_state["status"])
+        """Get job status."""
+        return self._status
     
     @property
     def progress(self) -> float:
-        """Get job progress from shared state."""
-        return self.shared_state["progress"]
+        """Get job progress."""
+        return self._progress
     
     @property
     def current_step(self) -> str:
-        """Get current step from shared state."""
-        return self.shared_state["current_step"]
+        """Get current step."""
+        return self._current_step
     
     @property
     def results(self):
-        """Get results from shared state."""
-        return self.shared_state["results"]
+        """Get results reported by the generation process."""
+        return self._results
     
     @property
     def error(self) -> Optional[str]:
-        """Get error from shared state."""
-        return self.shared_state["error"]
+        """Get error reported by the generation process."""
+        return self._error
     
     def cancel(self):
         """Cancel the generation job."""
         with self.lock:
-            current_status = JobStatus(self.shared_state["status"])
-            if current_status in (JobStatus.PENDING, JobStatus.PROCESSING):
+            if self._status in (JobStatus.PENDING, JobStatus.PROCESSING):
                 self.cancellation_event.set()
-                self.shared_state["status"] = JobStatus.CANCELLED.value
+                # Drops the task if it hasn't started yet; a running task sees the flag
+                if self.future is not None:
+                    self.future.cancel()
+                self._mark_terminal(JobStatus.CANCELLED)
                 logger.info(f"Job {self.job_id} cancelled")
-                # Terminate process if it's running
-                if self.process and self.process.is_alive():
-                    self.process.terminate()
-                    self.process.join(timeout=5.0)
-                    if self.process.is_alive():
-                        self.process.kill()
                 return True
         return False
     
     def cleanup(self):
-        """Clean up multiprocessing resources to prevent file descriptor leaks."""
+        """Clean up shared memory and stop the task to prevent resource leaks."""
         try:
-            # Close the progress queue
-            if hasattr(self, 'progress_queue'):
-                try:
-                    self.progress_queue.close()
-                    self.progress_queue.join_thread()
-                except Exception as e:
-                    logger.warning(f"Error closing progress queue for job {self.job_id}: {e}")
-            
-            # Shutdown the manager to close pipes
-            if hasattr(self, 'manager'):
-                try:
-                    self.manager.shutdown()
-                except Exception as e:
-                    logger.warning(f"Error shutting down manager for job {self.job_id}: {e}")
+            # Ensure the task stops
+            if self.future is not None and not self.future.done():
+                self.cancellation_event.set()
+                self.future.cancel()
             
-            # Ensure process is terminated
-            if self.process and self.process.is_alive():
-                self.process.terminate()
-                self.process.join(timeout=2.0)
-                if self.process.is_alive():
-                    self.process.kill()
+            # Free the progress ring (and the cancellation flag in it); a task still
+            # attached keeps its mapping
+            try:
+                self.progress_ring.close(unlink=True)
+            except Exception as e:
+                logger.warning(f"Error releasing progress ring for job {self.job_id}: {e}")
             
             logger.debug(f"Cleaned up resources for job {self.job_id}")
         except Exception as e:
@@ -151,66 +379,174 @@ class GenerationJob:
     
     def update_progress(self, progress: float, step: str = ""):
         """
-        Update job progress in shared state.
+        Update job progress.
         
         Args:
             progress: Progress percentage (0-100)
             step: Current step description
         """
         with self.lock:
-            self.shared_state["progress"] = max(0.0, min(100.0, progress))
+            self._progress = max(0.0, min(100.0, progress))
             if step:
-                self.shared_state["current_step"] = step
+                self._current_step = step
+            self._touch()
     
     def set_status(self, status: JobStatus):
-        """Set job status in shared state."""
+        """Set job status."""
         with self.lock:
-            self.shared_state["status"] = status.value
             if status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED):
-                self.shared_state["completed_at"] = datetime.now().isoformat()
-                self.completed_at = datetime.now()
+                self._mark_terminal(status)
+            else:
+                self._set_status_locked(status)
+            self._touch()
+    
+    def _touch(self):
+        """Invalidate the cached snapshot after a state change. Caller must hold self.lock."""
+        self.version += 1
+        self._snapshot = None
+    
+    def _set_status_locked(self, status: JobStatus):
+        """Set the job status. Caller must hold self.lock."""
+        self._status = JobStatus(status)
+    
+    def _mark_terminal(self, status: JobStatus):
+        """Record a terminal status and its completion time. Caller must hold self.lock."""
+        self._set_status_locked(status)
+        if self.completed_at is None:
+            self.completed_at = datetime.now()
+            self.completed_at_monotonic = time.monotonic()
+            if self.on_terminal is not None:
+                self.on_terminal(self)
+        self._touch()
     
-    def _poll_progress_queue(self):
-        """Poll progress queue and update shared state. Should be called periodically."""
+    def _task_outcome(self) -> JobOutcome:
+        """Turn the finished future into a JobOutcome like the task's own return value."""
+        if self.future.cancelled():
+            return JobOutcome(JobStatus.CANCELLED, step="Cancelled")
+        error = self.future.exception()
+        if error is not None:
+            return JobOutcome(JobStatus.FAILED, error=str(error) or type(error).__name__)
+        return self.future.result()
+    
+    def _lost_to_broken_pool(self) -> bool:
+        """
+        Whether the task only failed because its worker pool broke, so the manager will
+        submit it again: either the pool was broken on purpose to stop another job's
+        worker, or it broke before this task started. Caller must hold self.lock.
+        """
+        future = self.future
+        return (
+            future is not None
+            and future.done()
+            and not future.cancelled()
+            and isinstance(future.exception(), BrokenProcessPool)
+            and not self.cancellation_event.is_set()
+            and (self._restart_on_break or self.progress_ring.worker_pid == 0)
+            and self._attempts < MAX_TASK_ATTEMPTS
+        )
+    
+    def refresh(self):
+        """Apply progress from the ring buffer and the task outcome once it's done. Should be called periodically."""
         try:
-            while not self.progress_queue.empty():
-                update = self.progress_queue.get_nowait()
-                if isinstance(update, dict):
-                    if "progress" in update:
-                        self.shared_state["progress"] = max(0.0, min(100.0, update["progress"]))
-                    if "step" in update:
-                        self.shared_state["current_step"] = update["step"]
-                    if "status" in update:
-                        self.shared_state["status"] = update["status"]
-                    if "results" in update:
-                        self.shared_state["results"] = update["results"]
-                    if "error" in update:
-                        self.shared_state["error"] = update["error"]
+            # Apply everything under a single lock acquisition. The ring is drained
+            # here too since it only supports one consumer at a time.
+            with self.lock:
+                ring_updates = self.progress_ring.drain()
+                outcome = None
+                if (
+                    self.future is not None
+                    and self.future.done()
+                    and not self._outcome_applied
+                    and not self._lost_to_broken_pool()
+                ):
+                    self._outcome_applied = True
+                    outcome = self._task_outcome()
+                if not ring_updates and outcome is None:
+                    return
+                self._touch()
+                
+                # Merge the updates so each field is written at most once. Progress
+                # updates come first; the task outcome's status and results win.
+                progress = step = status = None
+                for update in ring_updates:
+                    progress = update.progress
+                    if update.step:
+                        step = update.step
+                    if update.status is not None:
+                        status = update.status
+                
+                if outcome is not None:
+                    if outcome.progress is not None:
+                        progress = outcome.progress
+                    if outcome.step:
+                        step = outcome.step
+                    # A job already finalized here (cancelled) keeps no results or
+                    # error from a task that ran on, e.g. the broken pool's error
+                    if self.completed_at is None:
+                        if outcome.results is not None:
+                            self._results = outcome.results
+                        if outcome.error is not None:
+                            self._error = outcome.error
+                    status = JobStatus(outcome.status)
+                
+                if progress is not None:
+                    self._progress = max(0.0, min(100.0, progress))
+                if step:
+                    self._current_step = step
+                # A status already finalized here (e.g. a cancel from the parent) wins
+                if self.completed_at is None and status is not None:
+                    if status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED):
+                        self._mark_terminal(status)
+                    else:
+                        self._set_status_locked(status)
         except Exception as e:
-            logger.warning(f"Error polling progress queue for job {self.job_id}: {e}")
+            logger.warning(f"Error polling progress for job {self.job_id}: {e}")
     
     def to_dict(self) -> Dict:
-        """Convert job to dictionary for API responses."""
-        # Poll progress queue before returning
-        self._poll_progress_queue()
+        """
+        Convert job to dictionary for API responses.
+        
+        Rebuilt only when the job's version changes; otherwise a copy of the cached
+        snapshot is returned.
+        """
+        # Poll for progress before returning
+        self.refresh()
         
         with self.lock:
-            return {
-                "job_id": self.job_id,
-                "status": self.shared_state["status"],
-                "progress": self.shared_state["progress"],
-                "current_step": self.shared_state["current_step"],
-                "prompt": self.prompt,
-                "duration": self.duration,
-                "lyrics": self.lyrics,
-                "num_versions": self.num_versions,
-                "format": self.format,
-                "manual_seeds": self.manual_seeds,
-                "results": self.shared_state["results"],
-                "error": self.shared_state["error"],
-                "created_at": self.created_at.isoformat(),
-                "completed_at": self.shared_state.get("completed_at"),
-            }
+            return dict(self._snapshot_locked())
+    
+    def _snapshot_locked(self) -> Dict:
+        """Return the cached snapshot, rebuilding it if stale. Caller must hold self.lock."""
+        if self._snapshot is None:
+            snapshot = self._static_dict.copy()
+            snapshot.update(
+                status=self._status.value,
+                progress=self._progress,
+                current_step=self._current_step,
+                results=self._results,
+                error=self._error,
+                completed_at=self.completed_at.isoformat() if self.completed_at else None,
+                version=self.version,
+            )
+            self._snapshot = snapshot
+        return self._snapshot
+
+
+# Number of independently locked job shards; must be a power of two
+JOB_SHARDS = 16
+
+# Number of worker processes generation tasks run on; one per GPU
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", 1))
+
+# Finished jobs are dropped this long after completion by the background sweeper
+JOB_MAX_AGE_SECONDS = int(os.getenv("JOB_MAX_AGE_SECONDS", 3600))
+JOB_SWEEP_INTERVAL_SECONDS = 60
+
+# A cancelled task still running after this long has its worker process stopped
+JOB_CANCEL_GRACE_SECONDS = int(os.getenv("JOB_CANCEL_GRACE_SECONDS", 30))
+# Time between SIGTERM and SIGKILL when stopping a worker process
+WORKER_KILL_GRACE_SECONDS = 5
+_SIGKILL = getattr(signal, "SIGKILL", signal.SIGTERM)
 
 
 class GenerationJobManager:
@@ -218,8 +554,235 @@ class GenerationJobManager:
     
     def __init__(self):
         """Initialize the job manager."""
-        self.jobs: Dict[str, GenerationJob] = {}
-        self.lock = threading.Lock()  # Use threading.Lock since we're in the main process
+        # Jobs are split over shards, each with its own threading.Lock (we're in the
+        # main process), so lookups on one job don't wait for a scan of another shard
+        self._shards: List[Tuple[threading.Lock, Dict[str, GenerationJob]]] = [
+            (threading.Lock(), {}) for _ in range(JOB_SHARDS)
+        ]
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+        
+        # Finished jobs ordered by completion time, plus the IDs still running, so
+        # cleanup only touches jobs that are due instead of scanning every job.
+        # Never acquire a job's lock while holding _expiry_lock (on_terminal runs
+        # with the job lock held and takes _expiry_lock).
+        self._expiry_lock = threading.Lock()
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._active_ids = set()
+        
+        # Generation tasks run on a shared pool of worker processes that keep their
+        # loaded model between jobs, instead of one new process per job
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # Run once in each worker process as it starts (see start_workers)
+        self._worker_initializer: Optional[Callable[[], None]] = None
+        
+        # Workers still running a cancelled task past its grace period are signalled
+        # by a reaper thread, ordered by (deadline, job_id, signal)
+        self._stop_heap: List[Tuple[float, str, int]] = []
+        self._stop_lock = threading.Lock()
+        self._stop_wakeup = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+    
+    def start_workers(self, initializer: Optional[Callable[[], None]] = None):
+        """
+        Start the worker pool ahead of the first job.
+        
+        Args:
+            initializer: Picklable module-level function run once in each worker process
+                as it starts (e.g. to load the model), and again in any replacement pool
+        """
+        with self._executor_lock:
+            self._worker_initializer = initializer
+            if self._executor is None:
+                self._executor = self._new_executor()
+                # The pool only starts its processes on the first submit
+                self._executor.submit(os.getpid)
+    
+    def _new_executor(self) -> ProcessPoolExecutor:
+        """Create a worker pool. Caller must hold self._executor_lock."""
+        return ProcessPoolExecutor(max_workers=GENERATION_WORKERS, initializer=self._worker_initializer)
+    
+    def submit_job(self, job: GenerationJob, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run a job's generation task on the worker pool.
+        
+        Args:
+            job: Job the task belongs to
+            fn: Picklable module-level task function; its return value is applied as
+                the job's final status update
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+            
+        Returns:
+            Future for the task
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            try:
+                future = self._executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OOM killer); start a fresh pool
+                logger.warning("Generation worker pool is broken, restarting it")
+                self._executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+                future = self._executor.submit(fn, *args, **kwargs)
+            pool = self._executor
+        
+        with job.lock:
+            job.future = future
+            job._pool = pool
+            job._restart_on_break = False
+            job._attempts += 1
+        future.add_done_callback(partial(self._on_task_done, job, fn, args, kwargs))
+        return future
+    
+    def _on_task_done(self, job: GenerationJob, fn: Callable, args: tuple, kwargs: dict, future: Future):
+        """Resubmit a task that was lost because its worker pool broke."""
+        try:
+            with job.lock:
+                retry = job.future is future and job._lost_to_broken_pool()
+                collateral = job._restart_on_break
+                if retry:
+                    # The task starts over; clear the PID of the worker that was lost
+                    job.progress_ring.set_worker_pid(0)
+            if retry:
+                if collateral:
+                    logger.warning(f"Restarting job {job.job_id} after its worker pool was restarted to stop a cancelled job")
+                else:
+                    logger.warning(f"Worker pool broke before job {job.job_id} started, resubmitting it")
+                self.submit_job(job, fn, *args, **kwargs)
+        except Exception as e:
+            # e.g. the job was already cleaned up and its ring buffer released
+            logger.warning(f"Could not resubmit job {job.job_id}: {e}")
+    
+    def _schedule_stop(self, job_id: str, delay: float, sig: int):
+        """Signal the worker running job_id after delay seconds if the task is still running."""
+        with self._stop_lock:
+            heapq.heappush(self._stop_heap, (time.monotonic() + delay, job_id, sig))
+            if self._reaper is None or not self._reaper.is_alive():
+                self._reaper = threading.Thread(
+                    target=self._reap_loop,
+                    name="generation-job-reaper",
+                    daemon=True
+                )
+                self._reaper.start()
+        self._stop_wakeup.set()
+    
+    def _reap_loop(self):
+        """Process scheduled worker stops in deadline order; exits when none are left."""
+        while True:
+            with self._stop_lock:
+                if not self._stop_heap:
+                    self._reaper = None
+                    return
+                deadline, job_id, sig = self._stop_heap[0]
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    heapq.heappop(self._stop_heap)
+            
+            if delay > 0:
+                self._stop_wakeup.wait(delay)
+                self._stop_wakeup.clear()
+                continue
+            self._stop_worker(job_id, sig)
+    
+    def _stop_worker(self, job_id: str, sig: int):
+        """Send sig to the worker still running a cancelled job, escalating SIGTERM to SIGKILL."""
+        try:
+            job = self.get_job(job_id)
+            if job is None:
+                return
+            with job.lock:
+                if job.future is None or job.future.done():
+                    return
+                pid = job.progress_ring.worker_pid
+                pool = job._pool
+            if not pid:
+                return
+            
+            # Killing the worker breaks the whole pool and fails every task on it.
+            # Mark the other jobs in flight there so _on_task_done resubmits them
+            # (from the start) to a fresh pool instead of failing them.
+            self._mark_for_restart(pool, exclude=job)
+            os.kill(pid, sig)
+            logger.warning(f"Sent {signal.Signals(sig).name} to worker {pid} still running cancelled job {job_id}")
+            if sig == signal.SIGTERM:
+                self._schedule_stop(job_id, WORKER_KILL_GRACE_SECONDS, _SIGKILL)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to stop worker for cancelled job {job_id}: {e}")
+    
+    def _mark_for_restart(self, pool, exclude: GenerationJob):
+        """Flag the unfinished jobs submitted to pool (except exclude) for resubmission if it breaks."""
+        with self._expiry_lock:
+            active_ids = list(self._active_ids)
+        for job_id in active_ids:
+            job = self.get_job(job_id)
+            if job is None or job is exclude:
+                continue
+            with job.lock:
+                if job._pool is pool and job.future is not None and not job.future.done():
+                    job._restart_on_break = True
+    
+    def shutdown(self):
+        """Stop the sweeper and the worker pool, and release every job's resources."""
+        self.stop_sweeper()
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        
+        for lock, jobs in self._shards:
+            with lock:
+                remaining = list(jobs.values())
+                jobs.clear()
+            for job in remaining:
+                job.cleanup()
+    
+    def start_sweeper(
+        self,
+        interval_seconds: float = JOB_SWEEP_INTERVAL_SECONDS,
+        max_age_seconds: int = JOB_MAX_AGE_SECONDS
+    ):
+        """
+        Start the background thread that removes old finished jobs, if it isn't running.
+        
+        Args:
+            interval_seconds: Time between sweeps
+            max_age_seconds: Age after completion at which a job is removed
+        """
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._sweeper_stop.clear()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop,
+            args=(interval_seconds, max_age_seconds),
+            name="generation-job-sweeper",
+            daemon=True
+        )
+        self._sweeper.start()
+    
+    def stop_sweeper(self, timeout: float = 5.0):
+        """Stop the background sweeper thread."""
+        self._sweeper_stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=timeout)
+            self._sweeper = None
+    
+    def _sweep_loop(self, interval_seconds: float, max_age_seconds: int):
+        """Run cleanup_old_jobs every interval_seconds until stopped."""
+        while not self._sweeper_stop.wait(interval_seconds):
+            try:
+                self.cleanup_old_jobs(max_age_seconds=max_age_seconds)
+            except Exception as e:
+                logger.warning(f"Error during background job cleanup: {e}")
+    
+    def _shard(self, job_id: str) -> Tuple[threading.Lock, Dict[str, GenerationJob]]:
+        """Return the (lock, jobs) shard that owns job_id."""
+        return self._shards[hash(job_id) & (JOB_SHARDS - 1)]
     
     def create_job(
         self,
@@ -248,13 +811,6 @@ class GenerationJobManager:
         Returns:
             Job ID
         """
-        # Periodically clean up old jobs to prevent resource leaks
-        # Clean up jobs older than 1 hour
-        try:
-            self.cleanup_old_jobs(max_age_seconds=3600)
-        except Exception as e:
-            logger.warning(f"Error during automatic cleanup: {e}")
-        
         if job_id is None:
             job_id = str(uuid.uuid4())
         
@@ -269,16 +825,22 @@ class GenerationJobManager:
             **kwargs
         )
         
-        with self.lock:
-            self.jobs[job_id] = job
+        job.on_terminal = self._record_completion
+        with self._expiry_lock:
+            self._active_ids.add(job_id)
+        
+        lock, jobs = self._shard(job_id)
+        with lock:
+            jobs[job_id] = job
         
         logger.info(f"Created generation job {job_id}")
         return job_id
     
     def get_job(self, job_id: str) -> Optional[GenerationJob]:
         """Get a job by ID."""
-        with self.lock:
-            return self.jobs.get(job_id)
+        lock, jobs = self._shard(job_id)
+        with lock:
+            return jobs.get(job_id)
     
     def cancel_job(self, job_id: str) -> bool:
         """
@@ -295,6 +857,16 @@ class GenerationJobManager:
             return job.cancel()
         return False
     
+    def _record_completion(self, job: GenerationJob):
+        """Queue a job that just reached a terminal status for expiry."""
+        with self._expiry_lock:
+            self._active_ids.discard(job.job_id)
+            heapq.heappush(self._expiry_heap, (job.completed_at_monotonic, job.job_id))
+        
+        # A cancelled task that doesn't notice the flag gets its worker stopped
+        if job.status == JobStatus.CANCELLED and job.future is not None and not job.future.done():
+            self._schedule_stop(job.job_id, JOB_CANCEL_GRACE_SECONDS, signal.SIGTERM)
+    
     def delete_job(self, job_id: str) -> bool:
         """
         Delete a job from memory.
@@ -305,15 +877,20 @@ class GenerationJobManager:
         Returns:
             True if deleted, False if not found
         """
-        with self.lock:
-            if job_id in self.jobs:
-                job = self.jobs[job_id]
-                # Clean up resources before deleting
-                job.cleanup()
-                del self.jobs[job_id]
-                logger.info(f"Deleted job {job_id}")
-                return True
-        return False
+        lock, jobs = self._shard(job_id)
+        with lock:
+            job = jobs.pop(job_id, None)
+        if job is None:
+            return False
+        
+        # Any expiry heap entry is skipped once the job is gone
+        with self._expiry_lock:
+            self._active_ids.discard(job_id)
+        
+        # Clean up resources outside the shard lock
+        job.cleanup()
+        logger.info(f"Deleted job {job_id}")
+        return True
     
     def cleanup_old_jobs(self, max_age_seconds: int = 3600):
         """
@@ -326,25 +903,36 @@ class GenerationJobManager:
             Number of jobs cleaned up
         """
         cleaned_count = 0
-        now = datetime.now()
         
-        with self.lock:
-            jobs_to_delete = []
-            for job_id, job in list(self.jobs.items()):
-                # Only clean up completed, failed, or cancelled jobs
-                if job.status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED):
-                    if job.completed_at:
-                        age_seconds = (now - job.completed_at).total_seconds()
-                        if age_seconds > max_age_seconds:
-                            jobs_to_delete.append(job_id)
+        # Terminal statuses (and completed_at) are only applied when a job is polled, so
+        # poll the running jobs; the ones that finished land in the expiry heap
+        with self._expiry_lock:
+            active_ids = list(self._active_ids)
+        for job_id in active_ids:
+            job = self.get_job(job_id)
+            if job is not None:
+                job.refresh()
+        
+        # Pop jobs that completed before the cutoff, oldest first
+        cutoff = time.monotonic() - max_age_seconds
+        expired = []
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] < cutoff:
+                expired.append(heapq.heappop(self._expiry_heap))
+        
+        for completed_at, job_id in expired:
+            lock, jobs = self._shard(job_id)
+            with lock:
+                job = jobs.get(job_id)
+                # Skip entries for jobs already deleted (or whose ID was reused since)
+                if job is None or job.completed_at_monotonic != completed_at:
+                    continue
+                del jobs[job_id]
             
-            # Delete outside the iteration
-            for job_id in jobs_to_delete:
-                job = self.jobs[job_id]
-                job.cleanup()
-                del self.jobs[job_id]
-                cleaned_count += 1
-                logger.info(f"Cleaned up old job {job_id}")
+            # Release resources outside the shard lock
+            job.cleanup()
+            cleaned_count += 1
+            logger.info(f"Cleaned up old job {job_id}")
         
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old job(s)")
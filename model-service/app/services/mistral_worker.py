@@ -0,0 +1,235 @@
+"""Persistent subprocess worker for Mistral lyrics generation."""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Restart the worker after this many jobs so memory held by the model is released periodically
+MAX_JOBS_PER_WORKER = int(os.getenv("MISTRAL_WORKER_MAX_JOBS", 50))
+
+
+def _worker_main(
+    job_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+    shutdown_event: multiprocessing.Event
+):
+    """
+    Load the Mistral model once and serve lyrics jobs until told to stop.
+    
+    Jobs arrive as (request_id, user_prompt, params) tuples and results are
+    returned as (request_id, lyrics, error). A None job stops the worker after
+    the jobs queued before it have been served.
+    """
+    # Import here to ensure it's in the subprocess context
+    from ..models.mistral_lyrics import MistralLyricsModel
+    
+    model_name = os.getenv("MISTRAL_MODEL_NAME", None)
+    device = os.getenv("DEVICE", "cpu")
+    
+    logger.info(f"Loading Mistral model in worker process (device: {device})")
+    model = MistralLyricsModel(model_name=model_name, device=device)
+    available = model.is_available()
+    
+    while not shutdown_event.is_set():
+        try:
+            job = job_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        
+        if job is None:
+            break
+        
+        request_id, user_prompt, params = job
+        if not available:
+            result_queue.put((
+                request_id,
+                None,
+                "Mistral model is not available. Please check model service configuration."
+            ))
+            continue
+        
+        try:
+            lyrics = model.generate(user_prompt=user_prompt, **params)
+            result_queue.put((request_id, lyrics, None))
+        except Exception as e:
+            logger.error(f"Mistral generation failed in worker: {e}", exc_info=True)
+            result_queue.put((request_id, None, str(e)))
+    
+    logger.info("Mistral worker process exiting")
+
+
+class MistralWorker:
+    """Long-lived subprocess that keeps the Mistral model loaded between requests."""
+    
+    def __init__(self, max_jobs: int = MAX_JOBS_PER_WORKER):
+        """
+        Initialize the worker handle. The subprocess (and the model) is started by the first job.
+        
+        Args:
+            max_jobs: Number of jobs a worker process serves before it is replaced
+        """
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._process: Optional[multiprocessing.Process] = None
+        # Worker finishing its queued jobs after being retired; its replacement is only
+        # spawned once it has exited, so the two never hold the model weights at once
+        self._retiring: Optional[multiprocessing.Process] = None
+        self._job_queue: Optional[multiprocessing.Queue] = None
+        self._shutdown_event: Optional[multiprocessing.Event] = None
+        self._jobs_submitted = 0
+        # request_id -> (future, process that owns the request)
+        self._pending: Dict[str, Tuple[Future, multiprocessing.Process]] = {}
+    
+    def stop(self, timeout: float = 10.0):
+        """Stop the worker process and fail any requests still waiting on it."""
+        with self._lock:
+            process = self._process
+            if process is None:
+                return
+            self._shutdown_event.set()
+            self._job_queue.put(None)
+            self._process = None
+        
+        process.join(timeout=timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=2.0)
+        self._fail_pending(process, "Mistral worker was shut down")
+        logger.info("Mistral worker stopped")
+    
+    def submit(self, user_prompt: str, **params: Any) -> Future:
+        """
+        Queue a lyrics job on the worker.
+        
+        Args:
+            user_prompt: User prompt for generation
+            **params: Keyword arguments forwarded to MistralLyricsModel.generate()
+        
+        Returns:
+            Future resolving to the generated lyrics, or raising RuntimeError on failure
+        """
+        request_id = str(uuid.uuid4())
+        future: Future = Future()
+        
+        while True:
+            with self._lock:
+                if (
+                    self._process is not None
+                    and self._process.is_alive()
+                    and self._jobs_submitted >= self.max_jobs
+                ):
+                    self._retire()
+                
+                retiring = self._retiring
+                if retiring is None or not retiring.is_alive():
+                    self._retiring = None
+                    if self._process is None or not self._process.is_alive():
+                        self._spawn()
+                    
+                    self._pending[request_id] = (future, self._process)
+                    self._jobs_submitted += 1
+                    self._job_queue.put((request_id, user_prompt, params))
+                    return future
+            
+            # Wait outside the lock: the retiring worker's results are resolved under it
+            retiring.join()
+    
+    async def generate(self, user_prompt: str, **params: Any) -> str:
+        """Generate lyrics on the worker without blocking the event loop."""
+        # submit() may wait for a retiring worker to exit, so it runs off the loop
+        future = await asyncio.to_thread(self.submit, user_prompt, **params)
+        return await asyncio.wrap_future(future)
+    
+    def _spawn(self):
+        """Start a new worker process. Caller must hold self._lock."""
+        job_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        shutdown_event = multiprocessing.Event()
+        
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(job_queue, result_queue, shutdown_event),
+            daemon=True
+        )
+        process.start()
+        
+        self._process = process
+        self._job_queue = job_queue
+        self._shutdown_event = shutdown_event
+        self._jobs_submitted = 0
+        
+        threading.Thread(
+            target=self._collect_results,
+            args=(process, result_queue),
+            name="mistral-worker-results",
+            daemon=True
+        ).start()
+        logger.info(f"Started Mistral worker process (pid: {process.pid})")
+    
+    def _retire(self):
+        """Let the current worker finish its queued jobs and exit. Caller must hold self._lock."""
+        if self._process is not None and self._process.is_alive():
+            logger.info(f"Retiring Mistral worker process (pid: {self._process.pid})")
+            self._job_queue.put(None)
+            self._retiring = self._process
+        self._process = None
+    
+    def _collect_results(self, process: multiprocessing.Process, result_queue: multiprocessing.Queue):
+        """Resolve futures from one worker process until it exits."""
+        while True:
+            try:
+                request_id, lyrics, error = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                continue
+            self._resolve(request_id, lyrics, error)
+        
+        # Pick up anything flushed right before the process exited
+        while True:
+            try:
+                request_id, lyrics, error = result_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._resolve(request_id, lyrics, error)
+        
+        self._fail_pending(process, f"Mistral worker exited unexpectedly (exit code: {process.exitcode})")
+        result_queue.close()
+    
+    def _resolve(self, request_id: str, lyrics: Optional[str], error: Optional[str]):
+        """Complete the future for a finished job."""
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+        
+        future, _ = entry
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(lyrics)
+    
+    def _fail_pending(self, process: multiprocessing.Process, message: str):
+        """Fail all requests owned by a worker process that is gone."""
+        with self._lock:
+            orphaned = [
+                request_id for request_id, (_, owner) in self._pending.items()
+                if owner is process
+            ]
+            futures = [self._pending.pop(request_id)[0] for request_id in orphaned]
+        
+        for future in futures:
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+
+# Global Mistral worker instance
+mistral_worker = MistralWorker()
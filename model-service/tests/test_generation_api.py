@@ -0,0 +1,94 @@
+"""Tests for the job status endpoints of the generation API."""
+
+import json
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import generation
+from app.services.generation_job import JobStatus, job_manager
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(generation.router, prefix="/model/v1")
+    return TestClient(app)
+
+
+@pytest.fixture
+def job():
+    job_id = job_manager.create_job(prompt="test", duration=10.0)
+    yield job_manager.get_job(job_id)
+    job_manager.delete_job(job_id)
+
+
+@pytest.mark.parametrize("endpoint", ["progress", "status"])
+def test_unchanged_job_returns_304(client, job, endpoint):
+    url = f"/model/v1/generate/{job.job_id}/{endpoint}"
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    
+    response = client.get(url, headers={"If-None-Match": etag})
+    
+    assert first.status_code == 200
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+@pytest.mark.parametrize("endpoint", ["progress", "status"])
+def test_changed_job_returns_a_new_etag(client, job, endpoint):
+    url = f"/model/v1/generate/{job.job_id}/{endpoint}"
+    etag = client.get(url).headers["ETag"]
+    job.update_progress(40.0, "Generating...")
+    
+    response = client.get(url, headers={"If-None-Match": etag})
+    
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["progress"] == 40.0
+
+
+def _events(response):
+    """Parse the status events of an SSE response, skipping comments."""
+    events = []
+    for message in "".join(response.iter_text()).split("\n\n"):
+        lines = message.splitlines()
+        if lines and lines[0] == "event: status":
+            events.append(json.loads(lines[1][len("data: "):]))
+    return events
+
+
+def test_events_stream_ends_on_terminal_status(client, job, monkeypatch):
+    monkeypatch.setattr(generation, "EVENTS_POLL_INTERVAL_SECONDS", 0.01)
+    job.set_status(JobStatus.PROCESSING)
+    
+    def finish():
+        time.sleep(0.1)
+        job.update_progress(50.0, "Generating...")
+        time.sleep(0.1)
+        job.set_status(JobStatus.COMPLETED)
+    
+    worker = threading.Thread(target=finish)
+    worker.start()
+    with client.stream("GET", f"/model/v1/generate/{job.job_id}/events") as response:
+        events = _events(response)
+    worker.join()
+    
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [event["status"] for event in events][0] == "processing"
+    assert 50.0 in [event["progress"] for event in events]
+    assert events[-1]["status"] == "completed"
+
+
+def test_events_stream_of_finished_job_sends_one_event(client, job):
+    job.set_status(JobStatus.FAILED)
+    
+    with client.stream("GET", f"/model/v1/generate/{job.job_id}/events") as response:
+        events = _events(response)
+    
+    assert [event["status"] for event in events] == ["failed"]
@@ -0,0 +1,223 @@
+"""Tests for the generation job progress plumbing."""
+
+import os
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services import generation_job
+from app.services.generation_job import (
+    GenerationJob,
+    GenerationJobManager,
+    JobOutcome,
+    JobStatus,
+    MAX_TASK_ATTEMPTS,
+    ProgressRing,
+    STEP_MAX_BYTES,
+    ThrottledProgress,
+)
+
+
+@pytest.fixture
+def ring():
+    ring = ProgressRing(capacity=4)
+    yield ring
+    ring.close(unlink=True)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(generation_job.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def manager():
+    manager = GenerationJobManager()
+    yield manager
+    manager.shutdown()
+
+
+def test_ring_drains_updates_in_order(ring):
+    assert ring.push(10.0, "Loading model...")
+    assert ring.push(20.0)
+    assert ring.push(100.0, "Done", JobStatus.COMPLETED)
+    
+    updates = ring.drain()
+    
+    assert [u.progress for u in updates] == [10.0, 20.0, 100.0]
+    assert [u.step for u in updates] == ["Loading model...", "", "Done"]
+    assert [u.status for u in updates] == [None, None, JobStatus.COMPLETED]
+    assert ring.drain() == []
+
+
+def test_ring_drops_updates_when_full(ring):
+    for i in range(ring.capacity):
+        assert ring.push(float(i))
+    
+    assert not ring.push(99.0)
+    assert [u.progress for u in ring.drain()] == [0.0, 1.0, 2.0, 3.0]
+    
+    # Draining frees the slots again
+    assert ring.push(4.0)
+    assert [u.progress for u in ring.drain()] == [4.0]
+
+
+def test_ring_wraps_around(ring):
+    pushed = []
+    drained = []
+    for i in range(ring.capacity * 3 + 1):
+        assert ring.push(float(i), f"step {i}")
+        pushed.append(float(i))
+        if i % 3 == 2:
+            drained.extend(u.progress for u in ring.drain())
+    drained.extend(u.progress for u in ring.drain())
+    
+    assert drained == pushed
+
+
+def test_ring_truncates_long_steps_on_a_character_boundary(ring):
+    ring.push(50.0, "é" * STEP_MAX_BYTES)
+    
+    (update,) = ring.drain()
+    
+    # Two bytes per character, with room left for the terminating NUL
+    assert update.step == "é" * ((STEP_MAX_BYTES - 1) // 2)
+
+
+def test_ring_header_holds_worker_pid_and_cancellation(ring):
+    assert ring.worker_pid == 0
+    assert not ring.cancellation_flag.is_set()
+    
+    ring.set_worker_pid(4242)
+    ring.cancellation_flag.set()
+    
+    assert ring.worker_pid == 4242
+    assert ring.cancellation_flag.is_set()
+    # The header fields don't leak into the records
+    assert ring.drain() == []
+
+
+def test_throttle_drops_same_step_updates_within_interval(ring, clock):
+    throttle = ThrottledProgress(ring, min_interval=0.1)
+    
+    throttle(10.0, "Generating...")
+    clock[0] += 0.05
+    throttle(11.0, "Generating...")
+    clock[0] += 0.06
+    throttle(12.0, "Generating...")
+    
+    assert [u.progress for u in ring.drain()] == [10.0, 12.0]
+
+
+def test_throttle_always_pushes_new_steps_and_statuses(ring, clock):
+    throttle = ThrottledProgress(ring, min_interval=0.1)
+    
+    throttle(10.0, "Generating...")
+    throttle(50.0, "Encoding...")
+    throttle(50.0, "Encoding...", JobStatus.PROCESSING)
+    throttle(51.0, "Encoding...")
+    
+    updates = ring.drain()
+    
+    assert [u.progress for u in updates] == [10.0, 50.0, 50.0]
+    assert updates[2].status == JobStatus.PROCESSING
+
+
+def test_cleanup_expires_only_jobs_finished_before_the_cutoff(manager, clock):
+    old = manager.create_job(prompt="old", duration=10.0)
+    manager.get_job(old).set_status(JobStatus.COMPLETED)
+    clock[0] += 50.0
+    recent = manager.create_job(prompt="recent", duration=10.0)
+    manager.get_job(recent).set_status(JobStatus.FAILED)
+    running = manager.create_job(prompt="running", duration=10.0)
+    manager.get_job(running).set_status(JobStatus.PROCESSING)
+    clock[0] += 20.0
+    
+    assert manager.cleanup_old_jobs(max_age_seconds=60) == 1
+    
+    assert manager.get_job(old) is None
+    assert manager.get_job(recent) is not None
+    assert manager.get_job(running) is not None
+
+
+def test_cleanup_skips_stale_heap_entries_for_reused_job_ids(manager, clock):
+    manager.create_job(prompt="first", duration=10.0, job_id="job-1")
+    manager.get_job("job-1").set_status(JobStatus.COMPLETED)
+    assert manager.delete_job("job-1")
+    
+    # The same ID is reused by a job that is still running when the first one's entry expires
+    manager.create_job(prompt="second", duration=10.0, job_id="job-1")
+    clock[0] += 100.0
+    
+    assert manager.cleanup_old_jobs(max_age_seconds=60) == 0
+    assert manager.get_job("job-1").prompt == "second"
+    
+    # It expires on its own completion time
+    manager.get_job("job-1").set_status(JobStatus.COMPLETED)
+    clock[0] += 30.0
+    assert manager.cleanup_old_jobs(max_age_seconds=60) == 0
+    clock[0] += 40.0
+    assert manager.cleanup_old_jobs(max_age_seconds=60) == 1
+    assert manager.get_job("job-1") is None
+
+
+def _stubborn_task(ring):
+    """Generation task that never checks its cancellation flag."""
+    ring.set_worker_pid(os.getpid())
+    while True:
+        time.sleep(0.05)
+
+
+def _slow_task(ring):
+    ring.set_worker_pid(os.getpid())
+    time.sleep(1.0)
+    return JobOutcome(JobStatus.COMPLETED, progress=100.0)
+
+
+def _wait_for(condition, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_stopping_a_cancelled_worker_restarts_the_other_jobs(monkeypatch):
+    monkeypatch.setattr(generation_job, "GENERATION_WORKERS", 2)
+    monkeypatch.setattr(generation_job, "JOB_CANCEL_GRACE_SECONDS", 0.2)
+    manager = GenerationJobManager()
+    try:
+        stubborn = manager.get_job(manager.create_job(prompt="stubborn", duration=10.0))
+        other = manager.get_job(manager.create_job(prompt="other", duration=10.0))
+        manager.submit_job(stubborn, _stubborn_task, stubborn.progress_ring)
+        _wait_for(lambda: stubborn.progress_ring.worker_pid != 0)
+        manager.submit_job(other, _slow_task, other.progress_ring)
+        _wait_for(lambda: other.progress_ring.worker_pid != 0)
+        assert other.progress_ring.worker_pid != stubborn.progress_ring.worker_pid
+        
+        stubborn.cancel()
+        
+        _wait_for(lambda: other.to_dict()["completed_at"] is not None)
+        assert other.status == JobStatus.COMPLETED
+        assert other._attempts == 2
+        assert stubborn.status == JobStatus.CANCELLED
+    finally:
+        manager.shutdown()
+
+
+def test_broken_pool_resubmission_is_capped():
+    job = GenerationJob(job_id="job-1", prompt="test", duration=10.0)
+    try:
+        job.future = Future()
+        job.future.set_exception(BrokenProcessPool("worker died"))
+        
+        job._attempts = MAX_TASK_ATTEMPTS - 1
+        assert job._lost_to_broken_pool()
+        
+        job._attempts = MAX_TASK_ATTEMPTS
+        assert not job._lost_to_broken_pool()
+    finally:
+        job.cleanup()
@@ -0,0 +1,86 @@
+"""Tests for the persistent Mistral worker process handling."""
+
+import os
+import queue
+
+import pytest
+
+from app.services import mistral_worker
+from app.services.mistral_worker import MistralWorker
+
+
+def _echo_worker(job_queue, result_queue, shutdown_event):
+    """Stand-in for the model worker: answers with the prompt and its own PID."""
+    while not shutdown_event.is_set():
+        try:
+            job = job_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if job is None:
+            break
+        
+        request_id, user_prompt, params = job
+        if user_prompt == "crash":
+            os._exit(1)
+        if user_prompt == "hang":
+            shutdown_event.wait()
+            break
+        result_queue.put((request_id, f"{user_prompt}:{os.getpid()}", None))
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setattr(mistral_worker, "_worker_main", _echo_worker)
+    worker = MistralWorker(max_jobs=2)
+    yield worker
+    worker.stop(timeout=2.0)
+
+
+def _answer(future):
+    lyrics, pid = future.result(timeout=10).split(":")
+    return lyrics, int(pid)
+
+
+def test_worker_starts_on_first_submit(worker):
+    assert worker._process is None
+    
+    lyrics, pid = _answer(worker.submit("hello"))
+    
+    assert lyrics == "hello"
+    assert pid == worker._process.pid
+
+
+def test_worker_is_replaced_after_max_jobs(worker):
+    first = [_answer(worker.submit(f"song {i}")) for i in range(2)]
+    retired = worker._process
+    
+    lyrics, pid = _answer(worker.submit("song 2"))
+    
+    assert [lyrics for lyrics, _ in first] == ["song 0", "song 1"]
+    assert first[0][1] == first[1][1] == retired.pid
+    assert lyrics == "song 2"
+    assert pid != retired.pid
+    # The replacement only starts once the retired worker has exited
+    assert not retired.is_alive()
+
+
+def test_requests_fail_when_the_worker_dies(worker):
+    future = worker.submit("crash")
+    
+    with pytest.raises(RuntimeError, match="exited unexpectedly"):
+        future.result(timeout=10)
+    assert worker._pending == {}
+    
+    # The next request gets a fresh worker
+    assert _answer(worker.submit("again"))[0] == "again"
+
+
+def test_stop_fails_requests_still_waiting(worker):
+    future = worker.submit("hang")
+    
+    worker.stop(timeout=2.0)
+    
+    # Failed by stop() or by the result collector noticing the exit, whichever runs first
+    with pytest.raises(RuntimeError, match="Mistral worker"):
+        future.result(timeout=10)
+    assert worker._pending == {}
@@ -0,0 +1,107 @@
+"""Tests for the SongGeneration helpers that don't need the LeVo checkout."""
+
+import json
+
+import pytest
+
+from app.models import song_generation
+from app.models.song_generation import SongGenerationModel, _StepProgress, _write_jsonl
+
+
+def _collect():
+    reports = []
+    return reports, lambda progress, step: reports.append((progress, step))
+
+
+def test_step_progress_parses_step_and_tqdm_counters():
+    reports, callback = _collect()
+    step_progress = _StepProgress(1, callback)
+    
+    step_progress.feed("step 100/500")
+    step_progress.feed(" 50%|#####     | 250/500 [00:10<00:10, 25.00it/s]")
+    
+    assert reports == [
+        (26.0, "Generating version 1/1 (step 100/500)..."),
+        (50.0, "Generating version 1/1 (step 250/500)..."),
+    ]
+
+
+def test_step_progress_ignores_lines_without_counters():
+    reports, callback = _collect()
+    step_progress = _StepProgress(1, callback)
+    
+    step_progress.feed("Loading checkpoint from /models/levo")
+    step_progress.feed("step 3/0")
+    
+    assert reports == []
+    assert step_progress.progress == 10.0
+
+
+def test_step_progress_advances_to_the_next_version_when_steps_restart():
+    reports, callback = _collect()
+    step_progress = _StepProgress(2, callback)
+    
+    step_progress.feed("step 500/500")
+    step_progress.feed("step 1/500")
+    step_progress.feed("step 250/500")
+    
+    assert reports[-1] == (70.0, "Generating version 2/2 (step 250/500)...")
+
+
+def test_step_progress_skips_small_increments():
+    reports, callback = _collect()
+    step_progress = _StepProgress(1, callback)
+    
+    step_progress.feed("step 1/1000")
+    step_progress.feed("step 5/1000")
+    step_progress.feed("step 7/1000")
+    
+    # 0.08% of the band per step; only the update that moves progress by 0.5 is reported
+    assert [step for _, step in reports] == ["Generating version 1/1 (step 7/1000)..."]
+
+
+ENTRIES = [
+    {"idx": "v1", "gt_lyric": "[verse] Strom fließt", "descriptions": "synthpop"},
+    {"idx": "v2", "gt_lyric": "[chorus] 電気", "descriptions": "ballad"},
+]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_write_jsonl_writes_one_utf8_line_per_entry(tmp_path, monkeypatch, use_orjson):
+    if use_orjson and not song_generation.ORJSON_AVAILABLE:
+        pytest.skip("orjson is not installed")
+    monkeypatch.setattr(song_generation, "ORJSON_AVAILABLE", use_orjson)
+    path = tmp_path / "input.jsonl"
+    
+    _write_jsonl(path, ENTRIES)
+    
+    lines = path.read_bytes().decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == ENTRIES
+    assert "fließt" in lines[0]
+
+
+def test_write_jsonl_replaces_existing_content(tmp_path):
+    path = tmp_path / "input.jsonl"
+    _write_jsonl(path, ENTRIES)
+    
+    _write_jsonl(path, ENTRIES[:1])
+    
+    assert [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] == ENTRIES[:1]
+
+
+def test_scan_output_dir_matches_files_to_version_ids(tmp_path):
+    for name in ["v1_0.wav", "v1_1.wav", "v2.mp3", "notes.txt", "other.flac"]:
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "v3.wav").mkdir()
+    
+    generated_by_id, audio_files = SongGenerationModel._scan_output_dir(tmp_path, ["v1", "v2", "v3"])
+    
+    assert generated_by_id["v1"].name in ("v1_0.wav", "v1_1.wav")
+    assert generated_by_id["v2"] == tmp_path / "v2.mp3"
+    # Directories never match
+    assert "v3" not in generated_by_id
+    assert sorted(path.name for path in audio_files) == ["v1_0.wav", "v1_1.wav", "v2.mp3"]
+
+
+def test_scan_output_dir_handles_an_empty_directory(tmp_path):
+    assert SongGenerationModel._scan_output_dir(tmp_path, ["v1"]) == ({}, [])